@@ -1,48 +1,193 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+import functools
 import json
 import os
 import os.path
 import pickle
 import re
+import threading
 
+from .cache import LruCache
 from .hebrew import Hebrew
+from .index import PostingIndex
+from .store import CorpusStore, CorpusStoreError
 
 
 _VERSE_URL = "https://www.blueletterbible.org/kjv/{b}/{c}/{v}/t_conc_{c_abs}{v_zfill}"
+_EN_WORD_RE = re.compile(r'<[^>]*>|(\w+)')  # <- Words, skipping over html tags
 _RESOURCES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'resources')
+_STORE_PATH = os.path.join(_RESOURCES_DIR, 'compiled', 'tanakh.b3c')
+_TOKEN_ATTRS = ['word', 'word_space', 'word_no_vowels', 'tlit', 'tlit_space']  # <- In CorpusStore.tokens order
 
 
 _HEBREW = Hebrew()
 with open(os.path.join(_RESOURCES_DIR, 'versification', 'versification.pickle'), 'rb') as f:
 	_VERSIFICATION = pickle.load(f)
 
+# Process-wide cache of loaded book content, weighted by the size of the source files. Set
+# B3_CORPUS_BUDGET_MB to evict the least-recently-used books once the budget is exceeded.
+_CONTENT_CACHE = LruCache()
+
+
+# The compiled corpus (see scripts/07_compile_corpus.py) is opened on first use, falling
+# back to the json resources if it hasn't been built.
+_STORE = None
+
+# Search indexes are built once per process on first use, or attached to the shared copies dumped
+# alongside the compiled corpus (see dump_indexes)
+_INDEXES = {}
+_INDEX_LOCK = threading.Lock()
+
+# Recent search results, so paging through them (or repeating popular searches) is just a slice.
+# Each entry weighs 1 + its number of verses, so B3_SEARCH_CACHE_SIZE bounds the verse-ids held.
+_RESULTS_CACHE = LruCache(maxsize=int(os.environ.get('B3_SEARCH_CACHE_SIZE', 1000000)))
+
+
+def set_corpus_budget(megabytes):
+	"""Limit the (approximate) memory used by loaded books, None for no limit."""
+	_CONTENT_CACHE.resize(None if megabytes is None else int(float(megabytes) * 1024 * 1024))
+
+
+def use_corpus_store(path):
+	"""Read books from this compiled corpus store (or from the json resources if None)."""
+	global _STORE
+	_STORE = CorpusStore(path) if path else False
+	_CONTENT_CACHE.clear()
+	_RESULTS_CACHE.clear()  # <- Cached verse-ids refer to the old corpus
+	with _INDEX_LOCK:
+		_INDEXES.clear()
+
+
+def _corpus_store():
+	global _STORE
+	if _STORE is None:
+		_STORE = CorpusStore(_STORE_PATH) if os.path.exists(_STORE_PATH) else False
+	return _STORE or None
+
+
+def search_cache_stats():
+	"""Hits, misses and size of the search results cache."""
+	return _RESULTS_CACHE.stats()
+
+
+def load_corpus():
+	"""Load the content of every book up front.
+
+	A compiled store is only mapped: its strings are decoded lazily, so that a pre-forking server's
+	workers keep sharing the mmap-ed pages rather than refcounting (and so copying) decoded objects.
+	"""
+	for book in _LIBRARY:
+		book.content
+
+
+def token_types(attr):
+	"""Distinct values of a token attribute (e.g. 'word_no_vowels') across the whole Tanakh."""
+	store = _corpus_store()
+	if store is not None:
+		# The store interns strings, so only each distinct string id needs decoding
+		return {store.string(i) for i in set(store.tokens[_TOKEN_ATTRS.index(attr)])}
+	return {getattr(token, attr) for book in _LIBRARY for verse in book.content for token in verse.he_tokens}
+
+
+def tlit_index():
+	"""Positional index of the transliterated Hebrew tokens."""
+	return _index('he')
+
+
+def english_index():
+	"""Positional index of the lower-cased English words."""
+	return _index('en')
+
+
+def dump_indexes():
+	"""Build the search indexes and write them next to the compiled corpus, for all processes to share."""
+	store = _corpus_store()
+	if store is None or store.build_id is None:
+		raise CorpusStoreError('The search indexes can only be dumped alongside a compiled corpus')
+	for lang, path in _index_paths(store).items():
+		_build_index(lang).dump(path, corpus=store.build_id)
+	return list(_index_paths(store).values())
+
+
+def _index(lang):
+	# Built once per process on first use, unless there's a dumped copy to attach to
+	with _INDEX_LOCK:
+		if lang not in _INDEXES:
+			_INDEXES[lang] = _attach_index(lang) or _build_index(lang)
+		return _INDEXES[lang]
+
+
+def _build_index(lang):
+	if lang == 'he':
+		return PostingIndex.build(
+			(book.verse_offset + i, [token.tlit for token in verse.he_tokens])
+			for book in _LIBRARY for i, verse in enumerate(book.content)
+		)
+	return PostingIndex.build(
+		(book.verse_offset + i, [word for word, _, _ in _iter_en_words(verse.english)])
+		for book in _LIBRARY for i, verse in enumerate(book.content)
+	)
+
+
+def _attach_index(lang):
+	# Only if it was dumped from the very corpus we're reading
+	store = _corpus_store()
+	if store is None or store.build_id is None or not os.path.exists(_index_paths(store)[lang]):
+		return None
+	index, header = PostingIndex.attach(_index_paths(store)[lang])
+	return index if header.get('corpus') == store.build_id else None
+
+
+def _index_paths(store):
+	root, _ = os.path.splitext(store.path)
+	return {lang: '{}.{}.b3i'.format(root, lang) for lang in ['he', 'en']}
+
 
 class Tanakh():
 	"""Wrapper around all books in Tanakh."""
 	@property
 	def books(self):
-		"""Make books lazy to free-up mem."""
-		return [Book(x[0], x[1], x[2], code=x[3] if len(x) > 3 else None) for x in _BOOKS]
+		"""All books, shared across the whole process."""
+		return _LIBRARY
 
 	def get_book(self, alias):
 		"""Get a specific book."""
-		books = [book for book in self.books if book.is_match(alias)]
-		if not books:
-			raise UnknownBookError('I can\'t find a book matching <strong>"{}"</strong>.<br>Please try again.'.format(alias))
-		return books[0]
+		return _LIBRARY[_book_indices(alias)[0]]
 
 	def search(self, search_str, start=None, end=None, book_filter=None, lang=None):
-		"""Find a word or phrase."""
+		"""Find a word or phrase, returning the totals and the hits in [start, end)."""
+		results = self.find(search_str, book_filter=book_filter, lang=lang)
+		return results.num_occurrences, results.num_verses, list(results.iter_hits(start, end))
+
+	def find(self, search_str, book_filter=None, lang=None):
+		"""Find the verses matching a word or phrase (without loading any of them)."""
+		key = (
+			' '.join(search_str.lower().split()),
+			resolve_book_filter(book_filter).indices,
+			lang,
+		)
+		results = _RESULTS_CACHE.get(key)
+		if results is None:
+			results = self._find(key[0], book_filter, lang)
+			_RESULTS_CACHE.put(key, results, weight=1 + results.num_verses)
+		return results
+
+	def _find(self, search_str, book_filter, lang):
 		search_obj = _make_search_obj(search_str)
-		num_occurrences, num_verses, verses = 0, 0, []
+		counts = Counter()
+		if lang != 'en':
+			counts.update(tlit_index().count_phrase(search_obj['he']))
+		if lang != 'he':
+			counts.update(english_index().count_phrase(search_obj['en']))
+		gids = sorted(counts)
+		verse_ids = array('I')
 		for book in self._iter_books(book_filter):
-			for verse in book.iter_verses():
-				num = verse.search(search_obj, lang=lang)
-				if num:
-					if start <= num_verses < end:
-						verses.append(verse)
-					num_occurrences += num
-					num_verses += 1
-		return num_occurrences, num_verses, verses
+			lo = bisect_left(gids, book.verse_offset)
+			hi = bisect_left(gids, book.verse_offset + book.num_verses)
+			verse_ids.extend(gids[lo:hi])
+		return SearchResults(search_obj, lang, verse_ids, array('I', [counts[gid] for gid in verse_ids]))
 
 	def get_passage(self, passage_str):
 		"""Return the matching (book, cv_start, cv_end) tuple."""
@@ -82,38 +227,54 @@ class Tanakh():
 
 	def pretty_book_filter(self, book_filter):
 		"""Make a pretty string."""
-		if book_filter:
-			pretty_parts = []
-			for part in book_filter.split(','):
-				if '-' in part:
-					start, end = part.split('-')
-					pretty_parts.append('{} - {}'.format(self.get_book(start).name, self.get_book(end).name))
-				else:
-					pretty_parts.append(self.get_book(part).name)
-			pretty = ', '.join(pretty_parts)
-			return ' & '.join(pretty.rsplit(', '))
-		else:
-			return 'the Tanakh'
+		return resolve_book_filter(book_filter).pretty
 
 	def _iter_books(self, book_filter):
-		if book_filter:
-			for part in book_filter.split(','):
-				if '-' in part:
-					start, end = part.split('-')
-					in_range = False
-					for book in self.books:
-						if not in_range and book.is_match(start):
-							in_range = True
-							yield book
-						elif in_range:
-							yield book
-							if book.is_match(end):
-								break
-				else:
-					yield self.get_book(part)
+		for i in resolve_book_filter(book_filter).indices:
+			yield _LIBRARY[i]
+
+
+class BookFilter(object):
+	"""A resolved book filter: the indices of its books (in filter order) and a pretty description."""
+	def __init__(self, indices, pretty):
+		self.indices = indices
+		self.pretty = pretty
+
+
+@functools.lru_cache(maxsize=1024)
+def resolve_book_filter(book_filter):
+	"""Resolve a filter like "Gen-Deu,Psa" (or None for the whole Tanakh)."""
+	if not book_filter:
+		return BookFilter(tuple(range(len(_LIBRARY))), 'the Tanakh')
+	indices, pretty_parts = [], []
+	for part in book_filter.split(','):
+		if '-' in part:
+			start, end = _split_range(part)
+			i = _book_indices(start)[0]
+			# The range ends at the first book matching the end alias (or else the end of the Tanakh)
+			j = next((j for j in _book_indices(end) if j >= i), len(_LIBRARY) - 1)
+			indices.extend(range(i, j + 1))
+			pretty_parts.append('{} - {}'.format(_LIBRARY[i].name, _LIBRARY[j].name))
 		else:
-			for book in self.books:
-				yield book
+			i = _book_indices(part)[0]
+			indices.append(i)
+			pretty_parts.append(_LIBRARY[i].name)
+	pretty = ', '.join(pretty_parts)
+	return BookFilter(tuple(sorted(set(indices), key=indices.index)), ' & '.join(pretty.rsplit(', ')))
+
+
+def _book_indices(alias):
+	indices = _ALIASES.get(alias.replace(' ', '').lower())
+	if not indices:
+		raise UnknownBookError('I can\'t find a book matching <strong>"{}"</strong>.<br>Please try again.'.format(alias))
+	return indices
+
+
+def _split_range(part):
+	bounds = part.split('-')
+	if len(bounds) != 2:
+		raise UnknownBookError('I can\'t understand the book range <strong>"{}"</strong>.<br>Please try again.'.format(part))
+	return bounds
 
 
 class Book(object):
@@ -134,15 +295,22 @@ class Book(object):
 		else:
 			self._aliases = set([name])
 			self._aliases |= set(name[:i].lower() for i in range(2, 6))
-		self._content = None
 		self.ch_offset = ch_offset
+		self.verse_offset = None  # <- Id of the first verse, across all books (set in _make_library)
+		num_verses = _VERSIFICATION[self.name]['num-verses']
+		self._chapter_offsets = [0]  # <- Index in content of the first verse of each chapter
+		for c in range(1, len(num_verses) + 1):
+			self._chapter_offsets.append(self._chapter_offsets[-1] + num_verses[c])
 
 	@property
 	def content(self):
-		"""Memoize content."""
-		if self._content is None:
-			self._content = self._init_content()
-		return self._content
+		"""Memoize content in the process-wide cache."""
+		content = _CONTENT_CACHE.get(self.name)
+		if content is None:
+			content = self._init_content()
+			weight = 0 if isinstance(content, _StoredVerses) else self._content_size()  # <- Stored books are mmap-ed
+			_CONTENT_CACHE.put(self.name, content, weight=weight)
+		return content
 
 	def is_match(self, alias):
 		"""Does this alias match this book?"""
@@ -153,22 +321,39 @@ class Book(object):
 		"""Num chapters in book."""
 		return _VERSIFICATION[self.name]['num-chapters']
 
+	@property
+	def num_verses(self):
+		"""Num verses in book."""
+		return self._chapter_offsets[-1]
+
 	def iter_verses(self, cv_start=None, cv_end=None):
 		"""Iterate over verses"""
 		c1 = 0 if not cv_start or not cv_start[0] else cv_start[0]
 		v1 = 0 if not cv_start or not cv_start[1] else cv_start[1]
 		c2 = 999 if not cv_end or not cv_end[0] else cv_end[0]
 		v2 = 999 if not cv_end or not cv_end[1] else cv_end[1]
-		for verse in self.content:
-			if (c1, v1) <= (verse.c, verse.v) <= (c2, v2):
-				yield verse
-	
+		start, end = self.verse_index(c1, v1), self.verse_index(c2, v2 + 1)
+		for verse in self.content[start:end]:
+			yield verse
+
+	def verse_index(self, c, v):
+		"""Index in content of the first verse at or after c:v."""
+		offsets = self._chapter_offsets
+		if c < 1:
+			return 0
+		if c >= len(offsets):
+			return offsets[-1]
+		return offsets[c - 1] + min(max(v, 1) - 1, offsets[c] - offsets[c - 1])
+
 	def _init_content(self):
+		store = _corpus_store()
+		if store is not None and self.name in store:
+			self.he_name = store.books[self.name]['he-name']
+			return _StoredVerses(store, self, *store.books[self.name]['verses'])
 		content = []
 		blobs = {}
 		for lan in ['en-parsed', 'he-parsed']:
-			path = os.path.join(_RESOURCES_DIR, 'sefaria', '{}.{}.json'.format(self.name, lan))
-			with open(path, 'r') as f:
+			with open(self._content_path(lan), 'r') as f:
 				blobs[lan] = json.load(f)
 		self.he_name = blobs['he-parsed']['heTitle']
 		for c, (en_chapter, he_chapter) in enumerate(zip(blobs['en-parsed']['text'], blobs['he-parsed']['text']), start=1):
@@ -177,6 +362,12 @@ class Book(object):
 				content.append(verse)
 		return content
 
+	def _content_size(self):
+		return sum(os.path.getsize(self._content_path(lan)) for lan in ['en-parsed', 'he-parsed'])
+
+	def _content_path(self, lan):
+		return os.path.join(_RESOURCES_DIR, 'sefaria', '{}.{}.json'.format(self.name, lan))
+
 
 class Verse(object):
 	"""Verse wrapper."""
@@ -211,24 +402,123 @@ class Verse(object):
 			search_obj = _make_search_obj(search_obj)
 
 		if not lang or lang == 'en':
-			num += len(search_obj['en'].findall(self.english))
-			if num:
-				self.english = search_obj['en'].sub('<span class="highlight">\g<1></span>', self.english)
+			num += sum(1 for _ in self._iter_en_matches(search_obj['en']))
 
 		if not lang or lang == 'he':
-			tokens = self.he_tokens
-			n = len(search_obj['he'])
-			for i in range(len(tokens) - n + 1):
-				for j, obj in enumerate(search_obj['he']):
-					success = obj.match(tokens[i + j].tlit)
-					if not success:
-						break
-				if success:
-					num += 1
-					for j in range(n):
-						tokens[i + j].highlight = True
+			num += sum(1 for _ in self._iter_he_matches(search_obj['he']))
 		return num
 
+	def hit(self, search_obj, lang='en'):
+		"""The matches of a search in this verse (which is shared, so never modified)."""
+		if isinstance(search_obj, str):
+			search_obj = _make_search_obj(search_obj)
+		en_spans, he_indices = [], set()
+
+		if not lang or lang == 'en':
+			en_spans.extend(self._iter_en_matches(search_obj['en']))
+
+		if not lang or lang == 'he':
+			for i in self._iter_he_matches(search_obj['he']):
+				he_indices.update(range(i, i + len(search_obj['he'])))
+		return SearchHit(self, en_spans, he_indices)
+
+	def _iter_en_matches(self, en_re_list):
+		# Yield the (start, end) char-span of each match
+		words = list(_iter_en_words(self.english))
+		n = len(en_re_list)
+		for i in range(len(words) - n + 1) if n else []:
+			if all(obj.match(words[i + j][0]) for j, obj in enumerate(en_re_list)):
+				yield words[i][1], words[i + n - 1][2]
+
+	def _iter_he_matches(self, he_re_list):
+		tokens = self.he_tokens
+		n = len(he_re_list)
+		for i in range(len(tokens) - n + 1):
+			for j, obj in enumerate(he_re_list):
+				success = obj.match(tokens[i + j].tlit)
+				if not success:
+					break
+			if success:
+				yield i
+
+
+class SearchResults(object):
+	"""The ids of the verses matching a search (in book-filter order) and their number of occurrences."""
+	def __init__(self, search_obj, lang, verse_ids, counts):
+		self.search_obj = search_obj
+		self.lang = lang
+		self.verse_ids = verse_ids
+		self.counts = counts
+
+	@property
+	def num_verses(self):
+		"""Num matching verses."""
+		return len(self.verse_ids)
+
+	@property
+	def num_occurrences(self):
+		"""Num matches across all verses."""
+		return sum(self.counts)
+
+	def iter_hits(self, start=None, end=None):
+		"""Lazily load the verses in [start, end) and find their matches."""
+		# Clamp rather than slice from the end, so a negative page is empty (not the last page)
+		start = max(start or 0, 0)
+		end = None if end is None else max(end, 0)
+		for gid in self.verse_ids[start:end]:
+			book = _LIBRARY[bisect_right(_VERSE_OFFSETS, gid) - 1]
+			yield book.content[gid - book.verse_offset].hit(self.search_obj, lang=self.lang)
+
+
+class SearchHit(object):
+	"""A verse to display, with the char-spans of its English and indices of its Hebrew tokens to highlight."""
+	def __init__(self, verse, en_spans=(), he_indices=()):
+		self.verse = verse
+		self.en_spans = tuple(_merge_spans(en_spans))  # <- Phrase matches can overlap, e.g. "holy holy" in "holy, holy, holy"
+		self.he_indices = frozenset(he_indices)
+
+
+class _StoredVerses(object):
+	"""Lazy sequence of the verses of a book in a compiled corpus store."""
+	def __init__(self, store, book, start, end):
+		self._store = store
+		self._book = book
+		self._start = start
+		self._end = end
+
+	def __len__(self):
+		return self._end - self._start
+
+	def __getitem__(self, i):
+		if isinstance(i, slice):
+			return [self[j] for j in range(*i.indices(len(self)))]
+		if i < 0:
+			i += len(self)
+		if not 0 <= i < len(self):
+			raise IndexError(i)
+		return _StoredVerse(self._store, self._book, self._start + i)
+
+
+class _StoredVerse(Verse):
+	"""Verse view which only decodes its text from the store when it is needed."""
+	def __init__(self, store, book, i):
+		self.book = book
+		self.c = store.verse_c[i]
+		self.v = store.verse_v[i]
+		self._store = store
+		self._i = i
+
+	@property
+	def english(self):
+		"""English text."""
+		return self._store.string(self._store.verse_en[self._i])
+
+	@property
+	def he_tokens(self):
+		"""Hebrew tokens."""
+		tokens = self._store.verse_tokens
+		return [Token(*self._store.token(k)) for k in range(tokens[self._i], tokens[self._i + 1])]
+
 
 class Token(object):
 	"""Token wrapper."""
@@ -238,7 +528,6 @@ class Token(object):
 		self.word_no_vowels = word_no_vowels
 		self.tlit = tlit
 		self.tlit_space = tlit_space
-		self.highlight = False
 
 	@property
 	def label(self):
@@ -247,17 +536,37 @@ class Token(object):
 
 
 def _make_search_obj(search_str, lang='en'):
+	en_re_list = []
+	for term in re.findall(r'[\w*]+', search_str.lower()):
+		en_re_list.append(re.compile('^{}$'.format(term.replace('*', r'\w*'))))
 	search_str = search_str.replace('.', '\\.')
-	en_re_expr = re.compile('({})'.format(search_str.replace('*', '\S*')), flags=re.IGNORECASE)
 	he_re_list = []
 	for term in re.split('[\s\-:]', search_str.lower()):
 		he_re_list.append(re.compile('^{}$'.format(term.replace('*', '.*'))))
 	return {
-		'en': en_re_expr,
+		'en': en_re_list,
 		'he': he_re_list,
 	}
 
 
+def _merge_spans(spans):
+	# Merge overlapping or touching (start, end) spans, so each char is highlighted at most once
+	merged = []
+	for start, end in sorted(spans):
+		if merged and start <= merged[-1][1]:
+			merged[-1] = merged[-1][0], max(end, merged[-1][1])
+		else:
+			merged.append((start, end))
+	return merged
+
+
+def _iter_en_words(english):
+	# Yield the (lower-cased word, start, end) of each English word
+	for match in _EN_WORD_RE.finditer(english):
+		if match.group(1):
+			yield match.group(1).lower(), match.start(1), match.end(1)
+
+
 class UnknownBookError(Exception):
 	pass
 
@@ -303,3 +612,27 @@ _BOOKS = [
 	('Ketuvim', '1 Chronicles', 338),
 	('Ketuvim', '2 Chronicles', 367),
 ]
+
+
+def _make_library():
+	books, verse_offset = [], 0
+	for x in _BOOKS:
+		book = Book(x[0], x[1], x[2], code=x[3] if len(x) > 3 else None)
+		book.verse_offset = verse_offset
+		verse_offset += book.num_verses
+		books.append(book)
+	return tuple(books)
+
+
+def _make_aliases():
+	aliases = {}
+	for i, book in enumerate(_LIBRARY):
+		for alias in book._aliases:
+			aliases.setdefault(alias, []).append(i)
+	return {alias: tuple(indices) for alias, indices in aliases.items()}
+
+
+_LIBRARY = _make_library()
+_VERSE_OFFSETS = [book.verse_offset for book in _LIBRARY]
+_ALIASES = _make_aliases()  # <- alias -> indices of the matching books (in canonical order)
+set_corpus_budget(os.environ.get('B3_CORPUS_BUDGET_MB') or None)
@@ -0,0 +1,75 @@
+from collections import OrderedDict
+import threading
+
+
+class LruCache(object):
+	"""Thread-safe least-recently-used cache with an optional weight budget.
+
+	Each entry has a weight (default 1) and the least-recently-used entries are evicted
+	whenever the total weight exceeds `maxsize`. A `maxsize` of None means unbounded.
+	"""
+	def __init__(self, maxsize=None):
+		self.maxsize = maxsize
+		self.hits = 0
+		self.misses = 0
+		self._entries = OrderedDict()
+		self._weight = 0
+		self._lock = threading.Lock()
+
+	def get(self, key, default=None):
+		"""Get an entry and mark it as recently used."""
+		with self._lock:
+			if key in self._entries:
+				self._entries.move_to_end(key)
+				self.hits += 1
+				return self._entries[key][0]
+			self.misses += 1
+			return default
+
+	def put(self, key, value, weight=1):
+		"""Add an entry, evicting old ones if we are over budget."""
+		with self._lock:
+			if key in self._entries:
+				self._weight -= self._entries.pop(key)[1]
+			self._entries[key] = value, weight
+			self._weight += weight
+			self._evict()
+
+	def resize(self, maxsize):
+		"""Change the budget."""
+		with self._lock:
+			self.maxsize = maxsize
+			self._evict()
+
+	def clear(self):
+		"""Drop everything."""
+		with self._lock:
+			self._entries.clear()
+			self._weight = 0
+
+	@property
+	def weight(self):
+		"""Total weight of all entries."""
+		return self._weight
+
+	def stats(self):
+		"""Summary of cache usage."""
+		return {
+			'hits': self.hits,
+			'misses': self.misses,
+			'entries': len(self._entries),
+			'weight': self._weight,
+			'maxsize': self.maxsize,
+		}
+
+	def __contains__(self, key):
+		return key in self._entries
+
+	def __len__(self):
+		return len(self._entries)
+
+	def _evict(self):
+		# Always keep the newest entry, even if it alone is over budget
+		while self.maxsize is not None and self._weight > self.maxsize and len(self._entries) > 1:
+			_, (_, weight) = self._entries.popitem(last=False)
+			self._weight -= weight
@@ -1,5 +1,11 @@
+import os
 import re
 
+from .cache import LruCache
+
+
+_TLIT_CACHE_SIZE = int(os.environ.get('B3_TLIT_CACHE_SIZE', 100000))
+
 
 class Hebrew(object):
     _CANTILLATIONS_RE = re.compile('[\u0591-\u05AF]')
@@ -220,24 +226,60 @@ class Hebrew(object):
     ]
     _MAP = {k: v for dct in [_CANTILLATIONS, _NIQQUD, _PUNCTUATION, _CHARS] for k, v in dct.items()}
     _IMAP = {v: k for k, v in _MAP.items()}
+    # Clumps are a char plus any following accents (the first char always starts a clump, the
+    # ignored marks are dropped everywhere else)
+    _IGNORE_RE = re.compile('[{}]+'.format(''.join([_NIQQUD['meteg'], _NIQQUD['rafe'], _NIQQUD['upper-dot'], _NIQQUD['lower-dot']])))
+    _CLUMP_RE = re.compile('.[{}]*'.format(''.join(sorted(set(_CANTILLATIONS.values()) | set(_NIQQUD.values())))), re.DOTALL)
+    _TRANSLIT_SUB_RES = [(re.compile(seq), sub) for seq, sub in _TRANSLIT_SUBS]
+    # One-pass deletion regexes (on Hebrew text, a char-class sub is faster than str.translate)
+    _STRIP_CANTILLATIONS_RE = re.compile('[\u0591-\u05AF\u05BD]+')  # <- Includes meteg
+    _STRIP_NIQQUD_RE = re.compile(_NIQQUD_RE.pattern + '+')
+    _STRIP_PUNCTUATION_RE = re.compile(_PUNCTUATION_RE.pattern + '+')
+    _STRIP_KEY_RE = re.compile('[{}{}]+'.format(_STRIP_CANTILLATIONS_RE.pattern[1:-2], _STRIP_PUNCTUATION_RE.pattern[1:-2]))
+    _BATCH_SEP = '\x00'
 
-    def __init__(self):
+    def __init__(self, cache_size=_TLIT_CACHE_SIZE):
         self._c_tmap = {''.join([self._MAP[i] for i in k]): v for k, v in self._CONS_TRANSLIT.items()}
         self._v_tmap = {''.join([self._MAP[i] for i in k]): v for k, v in self._VOWEL_TRANSLIT.items()}
         self._p_tmap = {''.join([self._MAP[i] for i in k]): v for k, v in self._PUNC_TRANSLIT.items()}
+        self._clump_tlits = {}  # <- Only a few thousand distinct clumps, so no need to bound these
+        self._sorted_clumps = {}
+        self._strip_res = {}
+        self._tlits = LruCache(maxsize=cache_size)
 
     def strip_cantillations(self, phrase):
         """Strip all cantillations."""
-        phrase = self._CANTILLATIONS_RE.sub('', phrase)
-        return phrase.replace(self._NIQQUD['meteg'], '')  # Meteg is messing with css-font :(
+        return self._STRIP_CANTILLATIONS_RE.sub('', phrase)  # <- Includes meteg, it's messing with css-font :(
 
     def strip_niqqud(self, phrase):
         """Strip all niqqud."""
-        return self._NIQQUD_RE.sub('', phrase)
+        return self._STRIP_NIQQUD_RE.sub('', phrase)
 
     def strip_punctuation(self, phrase):
         """Strip all punctuation."""
-        return self._PUNCTUATION_RE.sub('', phrase)
+        return self._STRIP_PUNCTUATION_RE.sub('', phrase)
+
+    def strip_many(self, phrases, cantillations=True, niqqud=False, punctuation=False):
+        """Strip a batch of phrases (e.g. all the verses of a book) in one pass."""
+        key = cantillations, niqqud, punctuation
+        strip_re = self._strip_res.get(key)
+        if strip_re is None:
+            chars = [
+                strip_re.pattern[1:-2] for strip, strip_re in zip(key, [self._STRIP_CANTILLATIONS_RE, self._STRIP_NIQQUD_RE, self._STRIP_PUNCTUATION_RE])
+                if strip
+            ]
+            strip_re = self._strip_res[key] = re.compile('[{}]+'.format(''.join(chars))) if chars else None
+        return self._sub_many(phrases, strip_re) if strip_re else list(phrases)
+
+    def normalize_key(self, phrase):
+        """Lookup key for a word: no cantillations or punctuation, with sorted niqqud (see sort_niqqud)."""
+        return self.sort_niqqud(self._STRIP_KEY_RE.sub('', phrase))
+
+    def normalize_keys(self, phrases):
+        """Lookup keys for a batch of words."""
+        phrases = self._sub_many(phrases, self._STRIP_KEY_RE)
+        keys = {phrase: self.sort_niqqud(phrase) for phrase in set(phrases)}
+        return [keys[phrase] for phrase in phrases]
 
     def split_tokens(self, phrase):
         """Split phrase into tokens and spaces."""
@@ -250,16 +292,54 @@ class Hebrew(object):
 
     def transliterate(self, phrase, reverse=False):
         """Transliterate to english."""
-        tlit = ''.join([self._tlit(clump) for clump in self._iter_clumps(phrase)])
-        for seq, sub in self._TRANSLIT_SUBS:
-            tlit = re.sub(seq, sub, tlit)
-        tlit = ' '.join(tlit.split()[::-1]) if reverse else tlit
-        return tlit.lower()   # <- lower looks a bit nicer
+        key = phrase, reverse
+        tlit = self._tlits.get(key)
+        if tlit is None:
+            tlit = self._transliterate(phrase, reverse)
+            self._tlits.put(key, tlit)
+        return tlit
+
+    def transliterate_many(self, phrases, reverse=False):
+        """Transliterate a batch of phrases, doing each distinct one only once."""
+        tlits = {phrase: self.transliterate(phrase, reverse) for phrase in set(phrases)}
+        return [tlits[phrase] for phrase in phrases]
+
+    def cache_stats(self):
+        """Usage of the transliteration cache."""
+        return self._tlits.stats()
 
     def sort_niqqud(self, phrase):
         """Ensure chars with multiple-niqqud have them in a consistent order."""
-        phrase = ''.join(''.join(sorted(clump, reverse=True)) for clump in self._iter_clumps(phrase))
-        return phrase.replace(self._NIQQUD['dagesh'], '')  # Dagesh doesn't alter the meaning
+        sorted_clumps = self._sorted_clumps
+        clumps = []
+        for clump in self._iter_clumps(phrase):
+            sorted_clump = sorted_clumps.get(clump)
+            if sorted_clump is None:
+                sorted_clump = sorted_clumps[clump] = ''.join(sorted(clump, reverse=True)).replace(self._NIQQUD['dagesh'], '')
+            clumps.append(sorted_clump)
+        return ''.join(clumps)  # <- Without dagesh, as it doesn't alter the meaning
+
+    def _sub_many(self, phrases, strip_re):
+        # One sub over the whole batch, unless the separator could get mixed up with the text
+        phrases = list(phrases)
+        joined = self._BATCH_SEP.join(phrases)
+        if joined.count(self._BATCH_SEP) != max(len(phrases) - 1, 0):
+            return [strip_re.sub('', phrase) for phrase in phrases]
+        return strip_re.sub('', joined).split(self._BATCH_SEP) if phrases else []
+
+    def _transliterate(self, phrase, reverse):
+        clump_tlits = self._clump_tlits
+        tlit = []
+        for clump in self._iter_clumps(phrase):
+            clump_tlit = clump_tlits.get(clump)
+            if clump_tlit is None:
+                clump_tlit = clump_tlits[clump] = self._tlit(clump)
+            tlit.append(clump_tlit)
+        tlit = ''.join(tlit)
+        for seq_re, sub in self._TRANSLIT_SUB_RES:
+            tlit = seq_re.sub(sub, tlit)
+        tlit = ' '.join(tlit.split()[::-1]) if reverse else tlit
+        return tlit.lower()   # <- lower looks a bit nicer
 
     def _tlit(self, clump):
         tlit = None
@@ -274,16 +354,6 @@ class Hebrew(object):
 
     def _iter_clumps(self, phrase):
         if phrase:
-            clump = phrase[0]
-            ignore = {self._NIQQUD[i] for i in ['meteg', 'rafe', 'upper-dot', 'lower-dot']}
-            accents = set(self._CANTILLATIONS.values()) | set(self._NIQQUD.values())
-            for i, c in enumerate(phrase[1:]):
-                if c in ignore:
-                    continue
-                if c in accents:
-                    clump += c
-                else:
-                    yield clump
-                    clump = c
-            yield clump
+            return self._CLUMP_RE.findall(phrase[0] + self._IGNORE_RE.sub('', phrase[1:]))
+        return []
 
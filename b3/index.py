@@ -0,0 +1,204 @@
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict
+import re
+
+from .store import StringTable, encode_strings, map_sections, write_sections
+
+
+# Postings are packed as (verse-id << _POS_BITS | token-position) so that the token at the
+# next position of the same verse is simply posting + 1
+_POS_BITS = 10
+_POS_MASK = (1 << _POS_BITS) - 1
+_LITERAL_RE = re.compile(r'^\^((?:[^.*?+\[\](){}|^$\\]|\\\.)*)\$$')
+_PREFIX_RE = re.compile(r'^\^((?:[^.*?+\[\](){}|^$\\]|\\\.)*)(.?)')
+# A wildcard pattern is literal chars separated by .* (or \w*), e.g. ^.*neph.*sh$
+_WILDCARD_RE = re.compile(r'^\^((?:[^.*?+\[\](){}|^$\\]|\\\.|\.\*|\\w\*)*)\$$')
+_WILDCARD_SPLIT_RE = re.compile(r'\.\*|\\w\*')
+_N = 3
+_START, _END = '\x02', '\x03'  # <- Anchors for n-grams at the start/end of a term
+_MAGIC = b'B3I\x01'
+
+
+class PostingIndex(object):
+	"""Positional inverted index from term -> sorted postings of (verse-id, token-position).
+
+	The terms are held sorted, with the postings of term `i` at `postings[offsets[i]:offsets[i + 1]]`.
+	"""
+	def __init__(self, terms, offsets, postings):
+		self.terms = terms
+		self.offsets = offsets
+		self.postings = postings
+		self._ngrams = None
+
+	@classmethod
+	def build(cls, docs):
+		"""Build from an iterable of (verse-id, terms) in ascending verse-id order."""
+		term_postings = defaultdict(list)
+		for gid, terms in docs:
+			if len(terms) > _POS_MASK:
+				raise ValueError('Verse {} has too many terms to index'.format(gid))
+			for pos, term in enumerate(terms):
+				term_postings[term].append(gid << _POS_BITS | pos)
+		terms = sorted(term_postings)
+		offsets, postings = array('I', [0]), array('I')
+		for term in terms:
+			postings.extend(term_postings[term])
+			offsets.append(len(postings))
+		return cls(terms, offsets, postings)
+
+	@classmethod
+	def attach(cls, path):
+		"""Memory-map an index written by `dump` (read-only and shared with any other process mapping it).
+
+		Returns the index and the extra header fields it was dumped with.
+		"""
+		header, arrays = map_sections(path, _MAGIC)
+		index = cls(StringTable(arrays['terms'], arrays['term-offsets']), arrays['offsets'], arrays['postings'])
+		index._ngrams = _NgramTable(
+			StringTable(arrays['ngrams'], arrays['ngram-offsets']), arrays['ngram-id-offsets'], arrays['ngram-ids'])
+		return index, header
+
+	def dump(self, path, **header):
+		"""Write the index (including its n-grams) to a file that can be attached with `attach`."""
+		grams = sorted(self.ngrams)
+		ngram_ids, ngram_id_offsets = array('I'), array('I', [0])
+		for gram in grams:
+			ngram_ids.extend(self.ngrams[gram])
+			ngram_id_offsets.append(len(ngram_ids))
+		sections = {'offsets': array('I', self.offsets), 'postings': array('I', self.postings)}
+		sections['terms'], sections['term-offsets'] = encode_strings(self.terms)
+		sections['ngrams'], sections['ngram-offsets'] = encode_strings(grams)
+		sections.update({'ngram-id-offsets': ngram_id_offsets, 'ngram-ids': ngram_ids})
+		write_sections(path, _MAGIC, header, sections)
+
+	def lookup(self, term):
+		"""Id of a term, or None."""
+		i = bisect_left(self.terms, term)
+		return i if i < len(self.terms) and self.terms[i] == term else None
+
+	def expand(self, term_re):
+		"""Ids of all terms fully matching this regex."""
+		literal = _literal(term_re)
+		if literal is not None:
+			i = self.lookup(literal)
+			return [] if i is None else [i]
+		# Only check the range of (sorted) terms sharing the literal prefix of the regex
+		prefix = _prefix(term_re)
+		if len(prefix) < _N:
+			# ...or, for leading/infix wildcards, the terms containing all of the pattern's n-grams
+			candidates = self._ngram_candidates(term_re)
+			if candidates is not None:
+				return [i for i in candidates if term_re.match(self.terms[i])]
+		lo = bisect_left(self.terms, prefix)
+		hi = bisect_left(self.terms, prefix + '\U0010ffff') if prefix else len(self.terms)
+		return [i for i in range(lo, hi) if term_re.match(self.terms[i])]
+
+	def match_phrase(self, term_res):
+		"""Sorted (verse-id, position) postings where consecutive terms match the regexes in turn."""
+		n = len(term_res)
+		if not n or n > _POS_MASK:
+			return []
+		postings = [self._postings(self.expand(term_re)) for term_re in term_res]
+		if n == 1:
+			return sorted(postings[0])
+		# Start from the rarest term and check the others at the relative positions
+		postings = [set(p) for p in postings]
+		j = min(range(n), key=lambda k: len(postings[k]))
+		return sorted(
+			p - j for p in postings[j]
+			if p & _POS_MASK >= j and all(p - j + k in postings[k] for k in range(n) if k != j)
+		)
+
+	def count_phrase(self, term_res):
+		"""Number of phrase matches per verse-id."""
+		return Counter(p >> _POS_BITS for p in self.match_phrase(term_res))
+
+	@property
+	def ngrams(self):
+		"""Map of n-gram -> ids of the terms containing it (built on first use)."""
+		if self._ngrams is None:
+			ngrams = defaultdict(lambda: array('I'))
+			for i, term in enumerate(self.terms):
+				for gram in set(_iter_ngrams(_START + term + _END)):
+					ngrams[gram].append(i)
+			self._ngrams = dict(ngrams)
+		return self._ngrams
+
+	def _ngram_candidates(self, term_re):
+		# Sorted ids of the terms containing every n-gram of a wildcard pattern (None if it has none)
+		match = _WILDCARD_RE.match(term_re.pattern)
+		if not match:
+			return None
+		pattern = _START + match.group(1) + _END
+		grams = set()
+		for fragment in _WILDCARD_SPLIT_RE.split(pattern):
+			grams.update(_iter_ngrams(fragment.replace('\\.', '.')))
+		if not grams:
+			return None
+		ids = sorted((self.ngrams.get(gram, ()) for gram in grams), key=len)
+		candidates = set(ids[0])
+		for other in ids[1:]:
+			candidates.intersection_update(other)
+		return sorted(candidates)
+
+	def _postings(self, ids):
+		if len(ids) == 1:
+			return self.postings[self.offsets[ids[0]]:self.offsets[ids[0] + 1]]
+		postings = []
+		for i in ids:
+			postings.extend(self.postings[self.offsets[i]:self.offsets[i + 1]])
+		return postings
+
+
+class _NgramTable(object):
+	# Read-only n-gram -> term-ids map over the arrays of an attached index
+	def __init__(self, grams, id_offsets, ids):
+		self._grams = grams
+		self._id_offsets = id_offsets
+		self._ids = ids
+
+	def get(self, gram, default=None):
+		i = bisect_left(self._grams, gram)
+		if i < len(self._grams) and self._grams[i] == gram:
+			return self._ids[self._id_offsets[i]:self._id_offsets[i + 1]]
+		return default
+
+	def __getitem__(self, gram):
+		ids = self.get(gram)
+		if ids is None:
+			raise KeyError(gram)
+		return ids
+
+	def __iter__(self):
+		return iter(self._grams)
+
+	def __len__(self):
+		return len(self._grams)
+
+
+def unpack(posting):
+	"""(verse-id, position) of a posting."""
+	return posting >> _POS_BITS, posting & _POS_MASK
+
+
+def _iter_ngrams(s):
+	for i in range(len(s) - _N + 1):
+		yield s[i:i + _N]
+
+
+def _prefix(term_re):
+	# The literal chars any match must start with (dropping a final char made optional by a quantifier)
+	match = _PREFIX_RE.match(term_re.pattern)
+	if not match or '|' in term_re.pattern:
+		return ''
+	prefix = match.group(1)
+	if match.group(2) in {'*', '?', '{'}:
+		prefix = prefix[:-1] if not prefix.endswith('\\.') else prefix[:-2]
+	return prefix.replace('\\.', '.')
+
+
+def _literal(term_re):
+	# A regex of the form ^...$ with no special chars (other than escaped dots) is a plain term
+	match = _LITERAL_RE.match(term_re.pattern)
+	return match.group(1).replace('\\.', '.') if match else None
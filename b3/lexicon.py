@@ -1,47 +1,83 @@
+from array import array
 from collections import defaultdict
 import json
+import mmap
+import os
 import os.path
 import re
+import threading
 import urllib.parse
 
+from .cache import LruCache
 from .hebrew import Hebrew
 
 
 _HEBREW = Hebrew()
 _STRONGS_URL = 'https://www.blueletterbible.org/lang/lexicon/lexicon.cfm?strongs={id}'
 _RESOURCES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'resources')
+_LEXICON_DIR = os.path.join(_RESOURCES_DIR, 'lexicon')
+_REF_BOOKS = [
+	'gen', 'exo', 'lev', 'num', 'deu', 'jos', 'jud', '1sam', '2sam', '1kin', '2kin', 'isa', 'jer', 'eze', 'hos', 'joe',
+	'amo', 'oba', 'jon', 'mic', 'nah', 'hab', 'zep', 'hag', 'zec', 'mal', 'psa', 'pro', 'job', 'son', 'rut', 'lam', 
+	'ecc', 'est', 'dan', 'ezr', 'neh', '1chr', '2chr',
+]
+_REF_BOOK_NUMS = {book: i for i, book in enumerate(_REF_BOOKS)}
+_DESCRIPTION_CACHE_SIZE = int(os.environ.get('B3_LEXICON_CACHE_SIZE', 20000))
 
 
 class Lexicon(object):
 	"""Wrapper around the Hebrew lexicon."""
-	def __init__(self):
+	def __init__(self, cache_size=_DESCRIPTION_CACHE_SIZE, lexicon_dir=_LEXICON_DIR):
 		self._strongs = None
 		self._lex = None
 		self._lex_root = None
+		self._packed_refs = {}
+		self._descriptions = LruCache(maxsize=cache_size)
+		self._lock = threading.Lock()
+		self._dir = lexicon_dir
 
 	@property
 	def strongs(self):
 		"""Strongs."""
 		if self._strongs is None:
-			self._strongs = self._load('Strongs.json')
+			self._strongs = self._load_once('_strongs', 'Strongs.json')
 		return self._strongs
 
 	@property
 	def lex(self):
 		"""Lexicon."""
 		if self._lex is None:
-			self._lex = self._load('Lexicon.json')
+			self._lex = self._load_once('_lex', 'Lexicon.json')
 		return self._lex
 
 	@property
 	def lex_root(self):
 		"""Lexicon for root words."""
 		if self._lex_root is None:
-			self._lex_root = self._load('LexiconRoot.json')
+			self._lex_root = self._load_once('_lex_root', 'LexiconRoot.json')
 		return self._lex_root
 
+	def refs(self, word):
+		"""All [book, c, v, i] refs of a word."""
+		return self._refs('Lexicon.json', self.lex.get(word))
+
+	def root_refs(self, root):
+		"""All [book, c, v, i] refs of a root word."""
+		return self._refs('LexiconRoot.json', self.lex_root.get(root))
+
 	def description(self, word):
-		"""Return an html-description of the word."""
+		"""Return an html-description of the word (memoized)."""
+		desc = self._descriptions.get(word)
+		if desc is None:
+			desc = self._description(word)
+			self._descriptions.put(word, desc)
+		return desc
+
+	def cache_stats(self):
+		"""Hits, misses and size of the description cache."""
+		return self._descriptions.stats()
+
+	def _description(self, word):
 		desc = ''
 		lex = self.lex.get(word)
 		if not lex:
@@ -58,7 +94,7 @@ class Lexicon(object):
 			desc += (
 				"The root word <strong>{}</strong> <em>\"{}\"</em> appears "
 				"<strong>{}</strong> times in the Tanakh, first in {}."
-				.format(lex['root'], lex['root-trans'], len(lex_root['refs']), self._make_ref_link(lex_root['refs'][0]))
+				.format(lex['root'], lex['root-trans'], _count(lex_root), self._make_ref_link(_first(lex_root)))
 			)
 		desc += '</p>'
 
@@ -85,17 +121,115 @@ class Lexicon(object):
 		href = "/search?{}".format(urllib.parse.urlencode({'text': pretty_ref}))
 		return '<a href="{href}">{ref}</a>'.format(ref=pretty_ref, href=href)
 
-	@staticmethod
-	def _load(resource):
-		path = os.path.join(_RESOURCES_DIR, 'lexicon', resource)
-		with open(path, 'r') as f:
+	def _refs(self, resource, entry):
+		if not entry:
+			return []
+		if 'refs' in entry:
+			return entry['refs']
+		if not entry['count']:
+			return []
+		# Compact entries have their refs packed in a separate file, only mapped when needed
+		with self._lock:
+			if resource not in self._packed_refs:
+				with open(self._path(resource, '.refs.bin'), 'rb') as f:
+					self._packed_refs[resource] = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)).cast('I')
+		start = entry['refs-at']
+		return [_unpack_ref(ref) for ref in self._packed_refs[resource][start:start + entry['count']]]
+
+	def _load_once(self, attr, resource):
+		# Stop concurrent requests all loading the same (big) json
+		with self._lock:
+			if getattr(self, attr) is None:
+				setattr(self, attr, self._load(resource))
+			return getattr(self, attr)
+
+	def _load(self, resource):
+		# Prefer the compact version of the resource if it has been built
+		path = self._path(resource, '.compact.json')
+		if os.path.exists(path):
+			with open(path, 'r') as f:
+				blob = json.load(f)
+			return _CompactEntries(blob['fields'], blob['entries'])
+		with open(os.path.join(self._dir, resource), 'r') as f:
 			return json.load(f)
 
+	def _path(self, resource, suffix):
+		return os.path.join(self._dir, resource.replace('.json', suffix))
+
+
+class _CompactEntries(object):
+	"""Read-only mapping over the rows of a compact lexicon resource."""
+	def __init__(self, fields, rows):
+		self._fields = fields
+		self._rows = rows
+
+	def get(self, key, default=None):
+		row = self._rows.get(key)
+		return default if row is None else dict(zip(self._fields, row))
+
+	def __getitem__(self, key):
+		return dict(zip(self._fields, self._rows[key]))
+
+	def __contains__(self, key):
+		return key in self._rows
+
+	def __len__(self):
+		return len(self._rows)
+
+
+def write_compact(resource, entries, lexicon_dir=_LEXICON_DIR):
+	"""Write the compact version of a lexicon resource.
+
+	Each entry is stored as a row of values (see `fields`), without its refs but with the `count` and
+	packed `first` ref precomputed. The refs themselves are packed (one uint32 each) into a separate
+	binary file, starting at `refs-at`.
+	"""
+	fields = []
+	for entry in entries.values():
+		fields = [k for k in entry if k != 'refs'] + ['count', 'first', 'refs-at']
+		break
+	compact, packed = {}, array('I')
+	for key, entry in entries.items():
+		refs = entry['refs']
+		first = _pack_ref(refs[0]) if refs else None
+		compact[key] = [entry[k] for k in fields[:-3]] + [len(refs), first, len(packed)]
+		packed.extend(_pack_ref(ref) for ref in refs)
+	path = os.path.join(lexicon_dir, resource)
+	with open(path.replace('.json', '.compact.json'), 'w') as f:
+		json.dump({'fields': fields, 'entries': compact}, f, ensure_ascii=False, separators=(',', ':'))
+	with open(path.replace('.json', '.refs.bin'), 'wb') as f:
+		packed.tofile(f)
+
+
+def ref_book(book_num):
+	"""The book code used in refs (e.g. 'gen') for the i-th book of the Tanakh."""
+	return _REF_BOOKS[book_num]
+
+
+def shared_lexicon():
+	"""The lexicon shared across the whole process."""
+	return _LEXICON
+
 
 def _ref_sort_key(ref):
-	book_num = [
-		'gen', 'exo', 'lev', 'num', 'deu', 'jos', 'jud', '1sam', '2sam', '1kin', '2kin', 'isa', 'jer', 'eze', 'hos', 'joe',
-		'amo', 'oba', 'jon', 'mic', 'nah', 'hab', 'zep', 'hag', 'zec', 'mal', 'psa', 'pro', 'job', 'son', 'rut', 'lam', 
-		'ecc', 'est', 'dan', 'ezr', 'neh', '1chr', '2chr',
-	]
-	return book_num.index(ref[0].lower()), ref[1], ref[2]
+	return _REF_BOOKS.index(ref[0].lower()), ref[1], ref[2]
+
+
+def _count(entry):
+	return entry['count'] if 'count' in entry else len(entry['refs'])
+
+
+def _first(entry):
+	return _unpack_ref(entry['first']) if 'first' in entry else entry['refs'][0]
+
+
+def _pack_ref(ref):
+	# book (6 bits) | chapter (8 bits) | verse (8 bits) | token (8 bits)
+	return _REF_BOOK_NUMS[ref[0].lower()] << 24 | ref[1] << 16 | ref[2] << 8 | ref[3]
+
+
+def _unpack_ref(packed):
+	return [_REF_BOOKS[packed >> 24], packed >> 16 & 0xFF, packed >> 8 & 0xFF, packed & 0xFF]
+
+
+_LEXICON = Lexicon()
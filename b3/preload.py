@@ -0,0 +1,50 @@
+# Warm-up for pre-forking servers (see gunicorn.conf.py). Loading everything in the master means the
+# forked workers share it (copy-on-write) instead of each paying for it on their first requests.
+import gc
+import resource
+import time
+
+from . import book
+from .lexicon import shared_lexicon
+
+
+def preload(corpus=True, indexes=True, lexicon=True, freeze=True):
+	"""Load the corpus, search indexes and lexicon up front, returning a report of what it took.
+
+	With `freeze`, everything loaded so far is moved out of the garbage collector's reach (gc.freeze),
+	so collections in forked workers don't write to (and so copy) the shared pages.
+	"""
+	report = {}
+
+	def step(name, func):
+		start = time.time()
+		func()
+		report[name] = time.time() - start
+
+	if corpus:
+		step('corpus', book.load_corpus)
+	if indexes:
+		step('tlit-index', lambda: book.tlit_index().ngrams)
+		step('english-index', lambda: book.english_index().ngrams)
+	if lexicon:
+		step('lexicon', lambda: (shared_lexicon().strongs, shared_lexicon().lex, shared_lexicon().lex_root))
+	if freeze:
+		step('gc-freeze', _freeze)
+	report['total'] = sum(report.values())
+	report['max-rss-mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+	return report
+
+
+def format_report(report):
+	"""One-line summary of a preload report."""
+	return 'Preloaded in {:.2f}s ({}), max rss {:.0f}MB'.format(
+		report['total'],
+		', '.join('{} {:.2f}s'.format(k, v) for k, v in report.items() if k not in {'total', 'max-rss-mb'}),
+		report['max-rss-mb'],
+	)
+
+
+def _freeze():
+	# Collect first, so the garbage isn't frozen along with everything else
+	gc.collect()
+	gc.freeze()
@@ -0,0 +1,174 @@
+# Compact binary corpus store: one file holding a deduplicated utf-8 string table plus flat
+# offset arrays for verses and tokens, so it can be memory-mapped and read without parsing.
+#
+#   magic (4 bytes) | header length (uint32) | json header | 8-byte aligned array sections
+#
+# The json header lists each book (Hebrew title and verse range) and the byte offset,
+# length and typecode of every array section. The same layout is used for the search
+# indexes (see PostingIndex.dump), so any number of processes can share one read-only copy.
+from array import array
+import hashlib
+import json
+import mmap
+import os
+import os.path
+import struct
+import sys
+
+
+_MAGIC = b'B3C\x01'
+_ALIGN = 8
+_TOKEN_FIELDS = ['word', 'word-space', 'word-no-vowels', 'tlit', 'tlit-space']
+
+
+class CorpusStore(object):
+	"""Read-only, memory-mapped view of a compiled corpus."""
+	def __init__(self, path):
+		self.path = path
+		header, self._arrays = map_sections(path, _MAGIC)
+		self.books = header['books']
+		self.build_id = header.get('build-id')
+		self.verse_c = self._arrays['verse-c']
+		self.verse_v = self._arrays['verse-v']
+		self.verse_en = self._arrays['verse-en']
+		self.verse_tokens = self._arrays['verse-tokens']
+		self.tokens = [self._arrays['token-' + field] for field in _TOKEN_FIELDS]
+		self._strings = self._arrays['strings']
+		self._string_offsets = self._arrays['string-offsets']
+		self._decoded = [None] * (len(self._string_offsets) - 1)
+
+	def __contains__(self, name):
+		return name in self.books
+
+	def string(self, i):
+		"""Decode (and memoize) a string from the string table."""
+		s = self._decoded[i]
+		if s is None:
+			s = self._decoded[i] = str(self._strings[self._string_offsets[i]:self._string_offsets[i + 1]], 'utf-8')
+		return s
+
+	def token(self, k):
+		"""The (word, word_space, word_no_vowels, tlit, tlit_space) tuple of a token."""
+		return tuple(self.string(field[k]) for field in self.tokens)
+
+
+def compile_corpus(sefaria_dir, names, path):
+	"""Compile the parsed sefaria json for the named books into a single store."""
+	strings, string_ids = [], {}
+
+	def intern(s):
+		i = string_ids.get(s)
+		if i is None:
+			i = string_ids[s] = len(strings)
+			strings.append(s)
+		return i
+
+	books = {}
+	sections = {name: array('H') for name in ['verse-c', 'verse-v']}
+	sections.update({name: array('I') for name in ['verse-en', 'verse-tokens']})
+	sections.update({'token-' + field: array('I') for field in _TOKEN_FIELDS})
+	sections['verse-tokens'].append(0)
+	num_verses = 0
+	for name in names:
+		blobs = {}
+		for lan in ['en-parsed', 'he-parsed']:
+			with open(os.path.join(sefaria_dir, '{}.{}.json'.format(name, lan)), 'r') as f:
+				blobs[lan] = json.load(f)
+		start = num_verses
+		for c, (en_chapter, he_chapter) in enumerate(zip(blobs['en-parsed']['text'], blobs['he-parsed']['text']), start=1):
+			for v, (en_verse, he_verse) in enumerate(zip(en_chapter, he_chapter), start=1):
+				sections['verse-c'].append(c)
+				sections['verse-v'].append(v)
+				sections['verse-en'].append(intern(en_verse))
+				for token in he_verse:
+					for field, value in zip(_TOKEN_FIELDS, token):
+						sections['token-' + field].append(intern(value))
+				sections['verse-tokens'].append(len(sections['token-word']))
+				num_verses += 1
+		books[name] = {'he-name': blobs['he-parsed']['heTitle'], 'verses': [start, num_verses]}
+
+	sections['strings'], sections['string-offsets'] = encode_strings(strings)
+	write_sections(path, _MAGIC, {'books': books}, sections)
+
+
+class StringTable(object):
+	"""Read-only sequence of the strings in an encoded string table (decoded on access)."""
+	def __init__(self, strings, offsets):
+		self._strings = strings
+		self._offsets = offsets
+
+	def __len__(self):
+		return len(self._offsets) - 1
+
+	def __getitem__(self, i):
+		if i < 0:
+			i += len(self)
+		if not 0 <= i < len(self):
+			raise IndexError(i)
+		return str(self._strings[self._offsets[i]:self._offsets[i + 1]], 'utf-8')
+
+
+def encode_strings(strings):
+	"""The (utf-8 bytes, offsets) arrays of a string table."""
+	encoded = [s.encode('utf-8') for s in strings]
+	offsets = array('I', [0])
+	for s in encoded:
+		offsets.append(offsets[-1] + len(s))
+	return array('B', b''.join(encoded)), offsets
+
+
+def write_sections(path, magic, header, sections):
+	"""Write a json header plus named arrays, in a layout that map_sections can map straight back.
+
+	The header gets a 'build-id' hashed from its other fields and the arrays, so rewriting the same
+	data gives the same file (and everything keyed on the build-id stays valid).
+	"""
+	digest = hashlib.sha1(json.dumps(header, sort_keys=True).encode('utf-8'))
+	for name in sorted(sections):
+		digest.update(name.encode('utf-8') + b'\0')
+		digest.update(sections[name])
+	header = dict(header, byteorder=sys.byteorder, **{'build-id': digest.hexdigest()[:16]})
+	# Two passes: the header holds the section offsets, which depend on the header length
+	layout = {}
+	header_len = 0
+	while True:
+		offset = _aligned(8 + header_len)
+		for name, arr in sections.items():
+			layout[name] = [offset, len(arr) * arr.itemsize, arr.typecode]
+			offset = _aligned(offset + len(arr) * arr.itemsize)
+		blob = json.dumps(dict(header, sections=layout)).encode('utf-8')
+		if len(blob) == header_len:
+			break
+		header_len = len(blob)
+	tmp_path = path + '.tmp'
+	with open(tmp_path, 'wb') as f:
+		f.write(magic + struct.pack('<I', header_len) + blob)
+		for name, arr in sections.items():
+			f.write(b'\0' * (layout[name][0] - f.tell()))
+			arr.tofile(f)
+	os.replace(tmp_path, path)
+
+
+def map_sections(path, magic):
+	"""Memory-map a file written by write_sections, returning its header and (zero-copy) arrays."""
+	with open(path, 'rb') as f:
+		buf = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+	if bytes(buf[:4]) != magic:
+		raise CorpusStoreError('{} is not a {} file'.format(path, magic[:3].decode()))
+	header_len, = struct.unpack('<I', buf[4:8])
+	header = json.loads(bytes(buf[8:8 + header_len]).decode('utf-8'))
+	if header['byteorder'] != sys.byteorder:
+		raise CorpusStoreError('{} was compiled on a {}-endian machine'.format(path, header['byteorder']))
+	arrays = {
+		name: buf[offset:offset + length].cast(typecode)
+		for name, (offset, length, typecode) in header['sections'].items()
+	}
+	return header, arrays
+
+
+def _aligned(offset):
+	return -(-offset // _ALIGN) * _ALIGN
+
+
+class CorpusStoreError(Exception):
+	pass
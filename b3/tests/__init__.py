@@ -0,0 +1,13 @@
+import importlib.util
+import os.path
+
+
+_SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))), 'scripts')
+
+
+def load_script(name):
+	"""Import a script from the scripts dir by file name, e.g. '02_create_translations'."""
+	spec = importlib.util.spec_from_file_location(name.split('_', 1)[1], os.path.join(_SCRIPTS_DIR, name + '.py'))
+	module = importlib.util.module_from_spec(spec)
+	spec.loader.exec_module(module)
+	return module
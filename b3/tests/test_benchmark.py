@@ -0,0 +1,24 @@
+import json
+
+from . import load_script
+
+
+def test_compare_flags_changes_beyond_the_threshold():
+	script = load_script('10_benchmark')
+	results = {name: {'median-ms': ms} for name, ms in [('a', 1.0), ('b', 2.0), ('c', 10.0), ('new', 1.0)]}
+	baseline = {name: {'median-ms': ms} for name, ms in [('a', 1.05), ('b', 1.0), ('c', 20.0)]}
+	lines = script.compare(results, baseline)
+	assert [line.split()[-1] for line in lines[1:]] == ['0.95x', 'slower', 'faster', '-']
+
+
+def test_run_saves_the_cases_that_were_run(tmp_path):
+	script = load_script('10_benchmark')
+	serve_prerendered = script.main._serve_prerendered
+	baseline_path = str(tmp_path / 'baseline.json')
+	with open(baseline_path, 'w') as f:
+		json.dump({'environment': {}, 'cases': {'other': {'median-ms': 1.0, 'min-ms': 1.0}}}, f)
+	script.run(repeat=1, pattern='search/phrase-*', baseline_path=baseline_path, save=True)
+	with open(baseline_path, 'r') as f:
+		cases = json.load(f)['cases']
+	assert sorted(cases) == ['other', 'search/phrase-en', 'search/phrase-he']
+	assert script.main._serve_prerendered == serve_prerendered
@@ -0,0 +1,96 @@
+import os.path
+
+from .. import book as b3_book
+from ..book import Tanakh
+
+
+def test_books_are_shared():
+	assert Tanakh().books is Tanakh().books
+	assert Tanakh().get_book('obadiah') is Tanakh().get_book('oba')
+
+
+def test_content_is_cached():
+	obadiah = Tanakh().get_book('obadiah')
+	assert obadiah.content is obadiah.content
+
+
+def test_content_budget_evicts_least_recently_used():
+	tanakh = Tanakh()
+	obadiah, jonah = tanakh.get_book('obadiah'), tanakh.get_book('jonah')
+	try:
+		b3_book.use_corpus_store(None)  # <- Only the json resources count against the budget
+		b3_book.set_corpus_budget(0)
+		obadiah.content
+		jonah.content
+		assert 'Jonah' in b3_book._CONTENT_CACHE
+		assert 'Obadiah' not in b3_book._CONTENT_CACHE
+	finally:
+		b3_book.set_corpus_budget(None)
+		b3_book.use_corpus_store(b3_book._STORE_PATH if os.path.exists(b3_book._STORE_PATH) else None)
+
+
+def test_search_returns_hits_without_modifying_shared_verses():
+	tanakh = Tanakh()
+	shared = next(tanakh.get_book('oba').iter_verses((1, 1), (1, 1)))
+	english = shared.english
+	_, _, hits = tanakh.search('Edom', start=0, end=100, book_filter='oba')
+	assert hits[0].verse is not None and hits[0].verse.english == english
+	assert [english[start:end] for start, end in hits[0].en_spans] == ['Edom']
+	_, _, hits = tanakh.search('chazon', start=0, end=100, book_filter='oba', lang='he')
+	assert hits[0].he_indices == {0} and hits[0].en_spans == ()
+	assert shared.english == english
+
+
+def test_overlapping_phrase_matches_are_merged():
+	isaiah_6_3 = next(Tanakh().get_book('isaiah').iter_verses((6, 3), (6, 3)))
+	hit = isaiah_6_3.hit('holy holy', lang='en')
+	assert len(hit.en_spans) == 1
+	start, end = hit.en_spans[0]
+	assert isaiah_6_3.english[start:end].lower() == 'holy, holy, holy'
+
+
+def test_find_pages_through_results():
+	results = Tanakh().find('nephesh', book_filter='gen-deu,psa', lang='he')
+	assert results.num_verses == len(results.verse_ids) and results.num_occurrences >= results.num_verses
+	page_2 = list(results.iter_hits(10, 20))
+	assert len(page_2) == 10
+	refs = [(hit.verse.book.name, hit.verse.c, hit.verse.v) for hit in results.iter_hits()]
+	assert [(hit.verse.book.name, hit.verse.c, hit.verse.v) for hit in page_2] == refs[10:20]
+	assert list(results.iter_hits(-20, -10)) == []  # <- e.g. ?page=-1
+	assert [(hit.verse.book.name, hit.verse.c, hit.verse.v) for hit in results.iter_hits(-10, 5)] == refs[:5]
+	assert [ref[0] for ref in refs] == sorted([ref[0] for ref in refs], key=['Genesis', 'Exodus', 'Leviticus', 'Numbers', 'Deuteronomy', 'Psalms'].index)
+
+
+def test_find_caches_results():
+	tanakh = Tanakh()
+	results = tanakh.find('Nephesh  Chayah', book_filter='Gen', lang='he')
+	stats = b3_book.search_cache_stats()
+	assert tanakh.find('nephesh chayah', book_filter='gen', lang='he') is results
+	assert b3_book.search_cache_stats()['hits'] == stats['hits'] + 1
+	assert tanakh.find('nephesh chayah', book_filter='gen', lang='en') is not results
+	b3_book.use_corpus_store(b3_book._STORE_PATH if os.path.exists(b3_book._STORE_PATH) else None)
+	assert tanakh.find('nephesh chayah', book_filter='gen', lang='he') is not results
+
+
+def test_iter_verses_slices_by_chapter():
+	psalms = Tanakh().get_book('psalms')
+	assert [(v.c, v.v) for v in psalms.iter_verses((119, None), (119, None))] == [(119, v) for v in range(1, 177)]
+	assert [(v.c, v.v) for v in psalms.iter_verses((119, 175), (120, 2))] == [(119, 175), (119, 176), (120, 1), (120, 2)]
+	assert [(v.c, v.v) for v in psalms.iter_verses((23, 4), (23, 4))] == [(23, 4)]
+	assert list(psalms.iter_verses((151, None), (151, None))) == []
+	assert len(list(psalms.iter_verses())) == psalms.num_verses
+
+
+def test_resolve_book_filter():
+	book_filter = b3_book.resolve_book_filter('Gen-Deu,Psa')
+	assert [Tanakh().books[i].name for i in book_filter.indices] == ['Genesis', 'Exodus', 'Leviticus', 'Numbers', 'Deuteronomy', 'Psalms']
+	assert book_filter.pretty == 'Genesis - Deuteronomy & Psalms'
+	assert b3_book.resolve_book_filter('Hos-Jo').pretty == 'Hosea - Joel'
+	assert b3_book.resolve_book_filter('gen,gen').indices == (0,)
+	assert b3_book.resolve_book_filter(None).pretty == 'the Tanakh'
+	for bad in ['xyz', 'Gen-xyz', 'Gen-Exo-Lev']:
+		try:
+			b3_book.resolve_book_filter(bad)
+			assert False, bad
+		except b3_book.UnknownBookError:
+			pass
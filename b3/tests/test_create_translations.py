@@ -0,0 +1,67 @@
+import json
+import threading
+import time
+
+from . import load_script
+
+
+def test_candidate_words():
+	script = load_script('02_create_translations')
+	assert script.candidate_words({'abc', 'ab'}, {'abc': 'x'}) == {'ab', 'bc', 'b', 'a', ''}
+
+
+def test_translate_all_checkpoints(tmp_path):
+	script = load_script('02_create_translations')
+	json_path = str(tmp_path / 'translations.json')
+	words = ['w{}'.format(i) for i in range(50)]
+	translations = script.translate_all(words, script.FakeTranslator(), {'old': None}, json_path, batch_size=5, concurrency=3, max_chars=60)
+	with open(json_path, 'r') as f:
+		assert json.load(f) == translations
+	assert len(translations) == 1 + 20 and translations['w0'] == '<w0>'
+
+	class Flaky(script.Translator):
+		def translate(self, batch):
+			if 'w7' in batch:
+				raise RuntimeError('Quota exceeded')
+			return [word.upper() for word in batch]
+
+	try:
+		script.translate_all(words[:10], Flaky(), {}, json_path, batch_size=5, concurrency=1)
+		assert False
+	except RuntimeError:
+		pass
+	with open(json_path, 'r') as f:
+		assert json.load(f) == {word: word.upper() for word in words[:5]}
+
+	started = threading.Event()
+
+	class SlowAndFlaky(script.Translator):
+		def translate(self, batch):
+			if 'w0' in batch:
+				started.wait(1)
+				raise RuntimeError('Quota exceeded')
+			started.set()
+			time.sleep(0.1)
+			return [word.upper() for word in batch]
+
+	# The second batch was already sent when the first failed, so it is finished and kept
+	try:
+		script.translate_all(words[:10], SlowAndFlaky(), {}, json_path, batch_size=5, concurrency=2)
+		assert False
+	except RuntimeError:
+		pass
+	with open(json_path, 'r') as f:
+		assert json.load(f) == {word: word.upper() for word in words[5:10]}
+
+
+def test_incomplete_translators_fail_up_front():
+	script = load_script('02_create_translations')
+
+	class Incomplete(script.Translator):
+		pass
+
+	try:
+		Incomplete()
+		assert False
+	except TypeError:
+		pass
@@ -1,11 +1,42 @@
 from ..hebrew import Hebrew
 
 
+GEN_1_1 = "בְּרֵאשִׁית בָּרָא אֱלֹהִים אֵת הַשָּׁמַיִם וְאֵת הָאָֽרֶץ"
+
+
 def test_transliteration():
-	gen_1_1 = "בְּרֵאשִׁית בָּרָא אֱלֹהִים אֵת הַשָּׁמַיִם וְאֵת הָאָֽרֶץ"
-	print(gen_1_1[:2].encode('raw_unicode_escape'))
 	heb = Hebrew()
-	tlit = heb.transliterate(gen_1_1)
-	print(tlit)
-	expected = "hello"
-	assert tlit == expected
\ No newline at end of file
+	assert heb.transliterate(GEN_1_1) == "b're'shith bara' elohim eth hashamayim w'eth ha'arets"
+	assert heb.transliterate(GEN_1_1, reverse=True) == "ha'arets w'eth hashamayim eth elohim bara' b're'shith"
+
+
+def test_transliteration_is_memoized():
+	heb = Hebrew()
+	tlit = heb.transliterate(GEN_1_1)
+	assert heb.transliterate(GEN_1_1) is tlit
+	assert heb.cache_stats()['hits'] == 1
+
+
+def test_transliterate_many():
+	heb = Hebrew()
+	words = GEN_1_1.split() + GEN_1_1.split()[:2]
+	assert heb.transliterate_many(words) == [heb.transliterate(word) for word in words]
+	assert heb.transliterate_many([]) == []
+
+
+def test_normalize_key():
+	heb = Hebrew()
+	words = GEN_1_1.split() + ['\u05d0\u05d1\u05be']
+	keys = [heb.sort_niqqud(heb.strip_punctuation(heb.strip_cantillations(word))) for word in words]
+	assert [heb.normalize_key(word) for word in words] == keys
+	assert heb.normalize_keys(words) == keys
+
+
+def test_strip_many():
+	heb = Hebrew()
+	verses = [GEN_1_1, '', GEN_1_1 + '\u05c3']
+	assert heb.strip_many(verses) == [heb.strip_cantillations(verse) for verse in verses]
+	assert heb.strip_many(verses, niqqud=True, punctuation=True) == [
+		heb.strip_punctuation(heb.strip_niqqud(heb.strip_cantillations(verse))) for verse in verses
+	]
+	assert heb.strip_many(['a\x00b', 'c'], niqqud=True) == ['a\x00b', 'c']
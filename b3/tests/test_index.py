@@ -0,0 +1,73 @@
+import re
+
+from ..book import Tanakh, _make_search_obj
+from ..index import PostingIndex, unpack
+
+
+def _res(*terms):
+	return [re.compile('^{}$'.format(term.replace('.', '\\.').replace('*', '.*'))) for term in terms]
+
+
+def test_match_phrase():
+	index = PostingIndex.build([
+		(0, ['nephesh', 'chayah', 'nephesh']),
+		(1, ['ha', 'nephesh', 'chayah']),
+		(2, ['chayah', 'nephesh']),
+	])
+	assert [unpack(p) for p in index.match_phrase(_res('nephesh', 'chayah'))] == [(0, 0), (1, 1)]
+	assert [unpack(p) for p in index.match_phrase(_res('*h'))] == [(0, 0), (0, 1), (0, 2), (1, 1), (1, 2), (2, 0), (2, 1)]
+	assert index.count_phrase(_res('nephesh')) == {0: 2, 1: 1, 2: 1}
+	assert index.match_phrase(_res('chayah', 'ha')) == []
+	assert index.match_phrase(_res('missing')) == []
+
+
+def test_search_matches_regex_scan():
+	tanakh = Tanakh()
+	for search_str, book_filter in [('nephesh chayah', None), ('ru*ch', 'gen-deu'), ("b're'shith", 'gen')]:
+		search_obj = _make_search_obj(search_str)
+		expected = [
+			(verse.book.name, verse.c, verse.v) for book in tanakh._iter_books(book_filter)
+			for verse in book.iter_verses() if verse.search(search_obj, lang='he')
+		]
+		_, num_verses, hits = tanakh.search(search_str, start=0, end=len(expected), book_filter=book_filter, lang='he')
+		assert num_verses == len(expected)
+		assert [(hit.verse.book.name, hit.verse.c, hit.verse.v) for hit in hits] == expected
+
+
+def test_expand_uses_sorted_prefix_range():
+	index = PostingIndex.build([(0, ['love', 'loved', 'lovingkindness', 'glove', 'lo'])])
+	assert [index.terms[i] for i in index.expand(_res('lov*')[0])] == ['love', 'loved', 'lovingkindness']
+	assert [index.terms[i] for i in index.expand(_res('*ove')[0])] == ['glove', 'love']
+	assert [index.terms[i] for i in index.expand(re.compile('^lo?ve$'))] == ['love']
+
+
+def test_english_search_is_word_based():
+	tanakh = Tanakh()
+	num_occurrences, num_verses, hits = tanakh.search('God created', start=0, end=1, book_filter='gen', lang='en')
+	assert (num_occurrences, num_verses) == (5, 4)
+	assert [hits[0].verse.english[start:end] for start, end in hits[0].en_spans] == ['God created']
+	# Whole words only (so "love" doesn't match "loved"), with wildcards expanding to every word
+	_, love, _ = tanakh.search('love', start=0, end=0, lang='en')
+	_, lov, _ = tanakh.search('lov*', start=0, end=0, lang='en')
+	assert 0 < love < lov
+
+
+def test_expand_leading_wildcards_with_ngrams():
+	index = PostingIndex.build([(0, ['nephesh', 'han-nephesh', 'naphshi', 'sh', 'shesh'])])
+	for pattern in ['*nephesh', '*sh', 'n*sh', '*ph*', '*e*e*', '*']:
+		term_re = _res(pattern)[0]
+		expected = [i for i, term in enumerate(index.terms) if term_re.match(term)]
+		assert index.expand(term_re) == expected
+	assert [index.terms[i] for i in index._ngram_candidates(_res('*nephesh')[0])] == ['han-nephesh', 'nephesh']
+
+
+def test_dump_and_attach(tmp_path):
+	index = PostingIndex.build([(0, ['love', 'loved', 'glove', 'ʼāb']), (3, ['glove', 'love'])])
+	path = str(tmp_path / 'test.b3i')
+	index.dump(path, corpus='abc')
+	attached, header = PostingIndex.attach(path)
+	assert header['corpus'] == 'abc'
+	assert list(attached.terms) == index.terms
+	for terms in [('love',), ('*ove',), ('glove', 'love'), ('*ā*',), ('missing',)]:
+		assert list(attached.match_phrase(_res(*terms))) == list(index.match_phrase(_res(*terms)))
+	assert {gram: list(attached.ngrams[gram]) for gram in attached.ngrams} == {gram: list(ids) for gram, ids in index.ngrams.items()}
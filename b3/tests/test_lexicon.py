@@ -0,0 +1,43 @@
+from ..lexicon import Lexicon, shared_lexicon, write_compact
+
+
+def _make_lexicon():
+	lexicon = Lexicon(cache_size=2)
+	lexicon._lex = {
+		'רֵאשִׁית': {'trans': 'beginning', 'root': 'ראשית', 'root-trans': 'beginning', 'sid': 'H7225', 'refs': [['gen', 1, 1, 0]]},
+	}
+	lexicon._lex_root = {'ראשית': {'sids': ['H7225'], 'refs': [['gen', 1, 1, 0], ['jer', 26, 1, 0]]}}
+	lexicon._strongs = {
+		'H7225': {'id': 'H7225', 'w': 'רֵאשִׁית', 'pron': "ray-sheeth'", 'desc': 'the <def>first</def>'},
+	}
+	return lexicon
+
+
+def test_description():
+	desc = _make_lexicon().description('רֵאשִׁית')
+	assert 'appears <strong>2</strong> times in the Tanakh, first in <a href="/search?text=Gen+1%3A1">Gen 1:1</a>' in desc
+	assert '<strong>רֵאשִׁית ray-sheeth\'</strong> - the <em>first</em>' in desc
+
+
+def test_description_is_memoized():
+	lexicon = _make_lexicon()
+	desc = lexicon.description('רֵאשִׁית')
+	assert lexicon.description('רֵאשִׁית') is desc
+	assert lexicon.cache_stats()['hits'] == 1
+	assert lexicon.description('missing') == "<p>Can't find this word in lexicon.</p>"
+
+
+def test_lexicon_is_shared():
+	assert shared_lexicon() is shared_lexicon()
+
+
+def test_compact_lexicon_round_trips(tmp_path):
+	original = _make_lexicon()
+	for resource, entries in [('Lexicon.json', original._lex), ('LexiconRoot.json', original._lex_root)]:
+		write_compact(resource, entries, str(tmp_path))
+	compact = Lexicon(lexicon_dir=str(tmp_path))
+	compact._strongs = original._strongs
+	assert compact.description('רֵאשִׁית') == original.description('רֵאשִׁית')
+	assert compact.refs('רֵאשִׁית') == [['gen', 1, 1, 0]]
+	assert compact.root_refs('ראשית') == original.root_refs('ראשית')
+	assert compact.refs('missing') == []
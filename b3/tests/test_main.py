@@ -0,0 +1,77 @@
+import gzip
+import os
+
+import brotli
+
+import main
+
+
+def test_build_hash_follows_content_not_mtimes(tmp_path, monkeypatch):
+	(tmp_path / 'templates').mkdir()
+	page = tmp_path / 'templates' / 'home.html'
+	page.write_text('<p>one</p>')
+	monkeypatch.setattr(main, 'ROOT_DIR', str(tmp_path))
+	monkeypatch.setattr(main, 'BUILD_PATHS', ['main.py', 'templates'])
+	build_id = main._build_hash()
+	os.utime(str(page), (0, 0))
+	(tmp_path / 'templates' / 'BibleHubScrape.Ruth.json').write_text('{}')
+	assert main._build_hash() == build_id
+	page.write_text('<p>two</p>')
+	assert main._build_hash() != build_id
+
+
+def test_validators_follow_the_build(monkeypatch):
+	client = main.app.test_client()
+	response = client.get('/home')
+	etag, last_modified = response.headers['ETag'], response.headers['Last-Modified']
+	assert client.get('/home', headers={'If-None-Match': etag}).status_code == 304
+	assert client.get('/home', headers={'If-Modified-Since': last_modified}).status_code == 304
+	monkeypatch.setattr(main, 'BUILD_ID', 'other')
+	monkeypatch.setattr(main, 'BUILD_TIME', main.BUILD_TIME + 1)
+	assert client.get('/home', headers={'If-None-Match': etag}).status_code == 200
+	assert client.get('/home', headers={'If-Modified-Since': last_modified}).status_code == 200
+
+
+def test_build_record_round_trip(tmp_path):
+	assert main._read_build_record(str(tmp_path)) is None
+	(tmp_path / 'BUILD').write_text('{"build-id": "abc", "build-time": 1}')
+	assert main._read_build_record(str(tmp_path)) == {'build-id': 'abc', 'build-time': 1}
+
+
+def test_gzip_is_stable():
+	body = b'<p>Bare Bones Bible</p>' * 100
+	assert main._gzip(body, 9) == main._gzip(body, 9)
+	assert gzip.decompress(main._gzip(body, 9)) == body
+
+
+def test_responses_are_gzipped(monkeypatch):
+	monkeypatch.setattr(main, 'COMPRESS_MIN_SIZE', 0)
+	response = main.app.test_client().get('/home', headers={'Accept-Encoding': 'gzip'})
+	assert response.content_encoding == 'gzip'
+	assert b'</html>' in gzip.decompress(response.get_data())
+
+
+def test_highlight_repeated_word_phrase():
+	response = main.app.test_client().get('/search?text=holy+holy+book:isa')
+	html = response.get_data(as_text=True)
+	assert '<span class="highlight">Holy, holy, holy</span>' in html
+	assert 'class="highlight">Holy, <spa' not in html
+
+
+def test_responses_prefer_brotli(monkeypatch):
+	monkeypatch.setattr(main, 'COMPRESS_MIN_SIZE', 0)
+	response = main.app.test_client().get('/home', headers={'Accept-Encoding': 'gzip, br'})
+	assert response.content_encoding == 'br'
+	assert b'</html>' in brotli.decompress(response.get_data())
+
+
+def test_prerendered_pages_are_sent_precompressed(tmp_path):
+	path = str(tmp_path / 'Obadiah' / '1.html')
+	main._write_prerendered(path, b'<html>Obadiah 1</html>')
+	for accept, encoding in [('gzip, br', 'br'), ('gzip', 'gzip'), ('', None)]:
+		with main.app.test_request_context('/book?name=Obadiah&chapter=1', headers={'Accept-Encoding': accept}):
+			response = main._send_prerendered(path)
+		assert response.content_encoding == encoding
+		body = response.get_data()
+		body = {'br': brotli.decompress, 'gzip': gzip.decompress, None: bytes}[encoding](body)
+		assert body == b'<html>Obadiah 1</html>'
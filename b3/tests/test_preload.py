@@ -0,0 +1,21 @@
+import os.path
+
+import pytest
+
+from .. import book as b3_book
+from ..preload import format_report, preload
+
+
+def test_preload():
+	report = preload(lexicon=False, freeze=False)
+	assert list(report) == ['corpus', 'tlit-index', 'english-index', 'total', 'max-rss-mb']
+	assert {'he', 'en'} <= set(b3_book._INDEXES)
+	assert format_report(report).startswith('Preloaded in ')
+
+
+def test_preload_leaves_the_store_strings_to_the_workers():
+	if not os.path.exists(b3_book._STORE_PATH):
+		pytest.skip('no compiled corpus store')
+	b3_book.use_corpus_store(b3_book._STORE_PATH)  # <- A freshly mapped store
+	preload(indexes=False, lexicon=False, freeze=False)
+	assert all(s is None for s in b3_book._corpus_store()._decoded)
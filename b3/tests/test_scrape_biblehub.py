@@ -0,0 +1,67 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os.path
+import re
+import threading
+
+from . import load_script
+from ..book import Tanakh
+
+
+class _StandIn(BaseHTTPRequestHandler):
+	# Obadiah has 21 verses, but pretend biblehub has 22 (and fails the first request for 1:5)
+	failed = set()
+
+	def do_GET(self):
+		if '/forbidden/' in self.path:
+			return self.send_error(403)
+		c, v = map(int, re.search(r'/obadiah/(\d+)-(\d+)\.htm$', self.path).groups())
+		if (c, v) == (1, 5) and (c, v) not in self.failed:
+			self.failed.add((c, v))
+			self.send_error(503)
+		elif c == 1 and v <= 22:
+			self.send_response(200)
+			self.end_headers()
+			self.wfile.write('<html><table class="maintext" id="x"><tr><td>{}:{}</td></tr></table></html>'.format(c, v).encode())
+		else:
+			self.send_error(404)
+
+	def log_message(self, *args):
+		pass
+
+
+def test_scrape_book(tmp_path):
+	server = ThreadingHTTPServer(('127.0.0.1', 0), _StandIn)
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	try:
+		scrape = load_script('03_scrape_biblehub')
+		base_url = 'http://127.0.0.1:{}/lexicon/{{book}}/{{c}}-{{v}}.htm'.format(server.server_port)
+		scraper = scrape.Scraper(base_url=base_url, concurrency=4, rate=None, backoff=0, lexicon_dir=str(tmp_path))
+		# A checkpoint from an earlier (interrupted) attempt is picked up
+		with open(str(tmp_path / 'BibleHubScrape.Obadiah.partial.jsonl'), 'w') as f:
+			f.write(json.dumps({'c': 1, 'v': 1, 'html': 'cached'}) + '\n{"c": 1, "v"')
+		path = scraper.scrape_book(Tanakh().get_book('obadiah'))
+		with open(path, 'r') as f:
+			data = json.load(f)['data']
+		assert [(item['c'], item['v']) for item in data] == [(1, v) for v in range(1, 23)]
+		assert data[0]['html'] == 'cached' and '1:5' in data[4]['html']
+		assert data[4]['url'] == base_url.format(book='obadiah', c=1, v=5)
+		assert not os.path.exists(str(tmp_path / 'BibleHubScrape.Obadiah.partial.jsonl'))
+	finally:
+		server.shutdown()
+
+
+def test_scrape_book_raises_scrape_errors(tmp_path):
+	server = ThreadingHTTPServer(('127.0.0.1', 0), _StandIn)
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	try:
+		scrape = load_script('03_scrape_biblehub')
+		base_url = 'http://127.0.0.1:{}/lexicon/{{book}}/{{c}}-{{v}}.htm'.format(server.server_port)
+		scraper = scrape.Scraper(base_url=base_url, concurrency=4, rate=None, backoff=0, lexicon_dir=str(tmp_path))
+		try:
+			scraper.fetch(base_url.format(book='forbidden', c=1, v=1))
+			assert False
+		except scrape.ScrapeError as e:
+			assert '403' in str(e)
+	finally:
+		server.shutdown()
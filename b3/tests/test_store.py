@@ -0,0 +1,35 @@
+import os.path
+
+from .. import book as b3_book
+from ..book import Tanakh
+from ..store import compile_corpus, CorpusStore
+
+
+def test_compiled_store_matches_json(tmp_path):
+	path = str(tmp_path / 'tanakh.b3c')
+	compile_corpus(os.path.join(b3_book._RESOURCES_DIR, 'sefaria'), ['Obadiah', 'Jonah'], path)
+	store = CorpusStore(path)
+	assert 'Jonah' in store and 'Genesis' not in store
+
+	jonah = Tanakh().get_book('jonah')
+	b3_book.use_corpus_store(None)
+	expected = [(v.c, v.v, v.english, [vars(t) for t in v.he_tokens]) for v in jonah.content]
+	try:
+		b3_book.use_corpus_store(path)
+		content = jonah.content
+		assert isinstance(content, b3_book._StoredVerses)
+		assert [(v.c, v.v, v.english, [vars(t) for t in v.he_tokens]) for v in content] == expected
+		assert content[-1].c == expected[-1][0] and len(content[:3]) == 3
+		assert jonah.he_name == store.books['Jonah']['he-name']
+	finally:
+		b3_book.use_corpus_store(b3_book._STORE_PATH if os.path.exists(b3_book._STORE_PATH) else None)
+
+
+def test_recompiling_gives_the_same_store(tmp_path):
+	paths = [str(tmp_path / name) for name in ['a.b3c', 'b.b3c']]
+	for path in paths:
+		compile_corpus(os.path.join(b3_book._RESOURCES_DIR, 'sefaria'), ['Obadiah'], path)
+	with open(paths[0], 'rb') as a, open(paths[1], 'rb') as b:
+		assert a.read() == b.read()
+	compile_corpus(os.path.join(b3_book._RESOURCES_DIR, 'sefaria'), ['Obadiah', 'Jonah'], paths[1])
+	assert CorpusStore(paths[0]).build_id != CorpusStore(paths[1]).build_id
@@ -0,0 +1,19 @@
+import threading
+import time
+
+
+class RateLimiter(object):
+	"""Spaces out calls (across all threads) so there are at most `rate` per second."""
+	def __init__(self, rate):
+		self._interval = 1 / rate if rate else 0
+		self._next = time.monotonic()
+		self._lock = threading.Lock()
+
+	def wait(self):
+		"""Block until the next call is allowed."""
+		with self._lock:
+			now = time.monotonic()
+			delay = self._next - now
+			self._next = max(now, self._next) + self._interval
+		if delay > 0:
+			time.sleep(delay)
@@ -0,0 +1,13 @@
+# Gunicorn config for App Engine (see the entrypoint in app.yaml)
+import os
+
+
+bind = ':{}'.format(os.environ.get('PORT', '8080'))
+workers = int(os.environ.get('GUNICORN_WORKERS', 4))
+# Load the app (and, in when_ready, all of its data) once in the master, so the workers share it
+preload_app = True
+
+
+def when_ready(server):
+	from b3.preload import format_report, preload
+	server.log.info(format_report(preload()))
@@ -1,18 +1,112 @@
+import fnmatch
+import functools
+import gzip
+import hashlib
+import io
+import json
 import math
+import os
 import os.path
 import re
+import time
 import urllib.parse
 
-from flask import Flask, render_template, redirect, request, url_for
+import brotli
+from flask import Flask, Response, abort, jsonify, render_template, redirect, request, url_for
+from markupsafe import Markup
 
-from b3.book import Tanakh, UnknownBookError
-from b3.lexicon import Lexicon
+from b3.book import SearchHit, Tanakh, UnknownBookError
+from b3.cache import LruCache
+from b3.lexicon import shared_lexicon
 
 
 app = Flask(__name__)
 
 
 SEARCH_LIMIT = 100
+PAGINATION_WINDOW = 3  # <- Num page links either side of the current page
+LAZY_MODALS_MIN_WORDS = 200  # <- Pages with more distinct words fetch word details on click
+WORD_API_LIMIT = 200
+CACHE_MAX_AGE = int(os.environ.get('B3_CACHE_MAX_AGE', 24 * 60 * 60))
+ROOT_DIR = os.path.dirname(os.path.realpath(__file__))
+BUILD_PATHS = ['main.py', 'resources', 'templates', 'b3']  # <- Everything a page's content depends on...
+BUILD_IGNORE = ['__pycache__', 'tests', 'prerendered', 'BibleHubScrape*']  # <- ...that is deployed (see .gcloudignore)
+PRERENDER_DIR = os.environ.get('B3_PRERENDER_DIR', os.path.join(ROOT_DIR, 'resources', 'prerendered'))
+PRECOMPRESSED = [('br', '.br'), ('gzip', '.gz')]  # <- In order of preference
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_MIMETYPES = {'text/html', 'application/json'}
+COMPRESSORS = {
+    'br': lambda body: brotli.compress(body, quality=5),
+    'gzip': lambda body: _gzip(body, 6),
+}
+# Compressed bodies of responses with an ETag, keyed on (etag, encoding) and weighted by size
+_COMPRESSED_CACHE = LruCache(maxsize=int(os.environ.get('B3_COMPRESSED_CACHE_MB', 64)) * 1024 * 1024)
+
+
+def _build_hash():
+    # Hash of the path and contents of every deployed file a page's content depends on
+    digest = hashlib.sha1()
+    for path in _iter_build_files():
+        digest.update(os.path.relpath(path, ROOT_DIR).encode() + b'\0')
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def _iter_build_files():
+    for build_path in BUILD_PATHS:
+        if os.path.isfile(os.path.join(ROOT_DIR, build_path)):
+            yield os.path.join(ROOT_DIR, build_path)
+        for dirpath, dirnames, filenames in os.walk(os.path.join(ROOT_DIR, build_path)):
+            dirnames[:] = sorted(d for d in dirnames if not _is_build_ignored(d))
+            for filename in sorted(filenames):
+                if not _is_build_ignored(filename):
+                    yield os.path.join(dirpath, filename)
+
+
+def _is_build_ignored(name):
+    return any(fnmatch.fnmatch(name, pattern) for pattern in BUILD_IGNORE)
+
+
+def _read_build_record(out_dir=PRERENDER_DIR):
+    # The {'build-id', 'build-time'} that the pre-rendered pages were built from, if any
+    try:
+        with open(os.path.join(out_dir, 'BUILD'), 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+# The corpus only changes between deployments, so pages are identified by the build + request args.
+# Both validators follow the build: the ETag hashes its id and Last-Modified is when it was built
+# (as recorded by scripts/09_prerender.py), or else when it was loaded.
+BUILD_ID = os.environ.get('B3_BUILD_ID') or _build_hash()
+_BUILD_RECORD = _read_build_record()
+if _BUILD_RECORD and _BUILD_RECORD.get('build-id') == BUILD_ID:
+    BUILD_TIME = _BUILD_RECORD['build-time']
+else:
+    BUILD_TIME = int(time.time())
+
+
+def conditional(view):
+    """Serve a view with ETag/Last-Modified validators, answering a matching request with a 304."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        args_str = urllib.parse.urlencode(sorted(request.args.items(multi=True)))
+        etag = hashlib.sha1('{}|{}|{}'.format(BUILD_ID, request.path, args_str).encode()).hexdigest()
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains_weak(etag)
+        else:
+            not_modified = request.if_modified_since is not None and request.if_modified_since.timestamp() >= BUILD_TIME
+        response = Response(status=304) if not_modified else app.make_response(view(*args, **kwargs))
+        if response.status_code in {200, 304}:
+            response.set_etag(etag, weak=True)  # <- Weak, as the same page may be sent with different encodings
+            response.last_modified = BUILD_TIME
+            response.cache_control.public = True
+            response.cache_control.max_age = CACHE_MAX_AGE
+        return response
+    return wrapper
 
 
 @app.route('/')
@@ -22,23 +116,30 @@ def root():
 
 
 @app.route('/home')
+@conditional
 def home():
     """Home page."""
     return render_template('home.html', page='home')
 
 
 @app.route('/book')
+@conditional
 def book():
     """Show book."""
     name = request.args['name']
     chapter = request.args.get('chapter')
     try:
+        if _serve_prerendered and set(request.args) <= {'name', 'chapter'}:
+            path = _prerendered_path(Tanakh().get_book(name).name, int(chapter) if chapter else None)
+            if os.path.exists(path):
+                return _send_prerendered(path)
         return _make_chapter(name, int(chapter)) if chapter else _make_chapter_select(name)
     except UnknownBookError as e:
         return render_template('home.html', page='error', msg=str(e))
 
 
 @app.route('/search')
+@conditional
 def search():
     """Search for a range of text."""
     search_str = request.args['text'].strip()
@@ -49,19 +150,132 @@ def search():
         return render_template('home.html', page='error', msg=str(e))
 
 
+@app.route('/api/word')
+@conditional
+def api_word():
+    """Lexicon descriptions for one or more words (?word=...&word=...)."""
+    words = request.args.getlist('word')
+    if not words or len(words) > WORD_API_LIMIT:
+        abort(400)
+    lexicon = shared_lexicon()
+    return jsonify({'words': {word: lexicon.description(word) for word in words}})
+
+
+@app.after_request
+def compress(response):
+    """Compress responses with the best encoding the client accepts (reusing cached bodies)."""
+    if (response.status_code != 200 or response.direct_passthrough or response.content_encoding
+            or response.mimetype not in COMPRESS_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = _accepted_encoding()
+    body = response.get_data()
+    if encoding is None or len(body) < COMPRESS_MIN_SIZE:
+        return response
+    etag, _ = response.get_etag()
+    data = _COMPRESSED_CACHE.get((etag, encoding)) if etag else None
+    if data is None:
+        data = COMPRESSORS[encoding](body)
+        if etag:
+            _COMPRESSED_CACHE.put((etag, encoding), data, weight=len(data))
+    response.set_data(data)
+    response.content_encoding = encoding
+    return response
+
+
+def compressed_cache_stats():
+    """Usage of the compressed-response cache."""
+    return _COMPRESSED_CACHE.stats()
+
+
+@app.template_filter('highlight')
+def highlight(text, spans):
+    """Wrap the (start, end) char-spans of some html in highlight tags."""
+    for start, end in reversed(spans):
+        text = '{}<span class="highlight">{}</span>{}'.format(text[:start], text[start:end], text[end:])
+    return Markup(text)
+
+
 @app.errorhandler(404)
 def page_not_found(e):
     """Nice 404 error."""
     return render_template('home.html', page='error', msg="That page doesn't exist!"), 404
 
 
+def prerender(out_dir=PRERENDER_DIR):
+    """Render every chapter and chapter-select page, plus compressed variants, into a static tree."""
+    num_pages = 0
+    for book in Tanakh().books:
+        for chapter in [None] + list(range(1, book.num_chapters + 1)):
+            args = {'name': book.name, 'chapter': chapter} if chapter else {'name': book.name}
+            with app.test_request_context('/book?' + urllib.parse.urlencode(args)):
+                html = _make_chapter(book.name, chapter) if chapter else _make_chapter_select(book.name)
+            _write_prerendered(_prerendered_path(book.name, chapter, out_dir), html.encode('utf-8'))
+            num_pages += 1
+    with open(os.path.join(out_dir, 'BUILD'), 'w') as f:
+        json.dump({'build-id': BUILD_ID, 'build-time': BUILD_TIME}, f)
+    return num_pages
+
+
+def _prerendered_path(name, chapter, out_dir=PRERENDER_DIR):
+    return os.path.join(out_dir, name.replace(' ', '_'), '{}.html'.format(chapter or 'index'))
+
+
+def _write_prerendered(path, body):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    variants = [(path, body), (path + '.gz', _gzip(body, 9)), (path + '.br', brotli.compress(body))]
+    for variant_path, data in variants:
+        with open(variant_path, 'wb') as f:
+            f.write(data)
+
+
+def _gzip(body, level):
+    # gzip.compress only takes an mtime from python 3.8, and a fixed one keeps the output stable
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=level, mtime=0) as f:
+        f.write(body)
+    return buf.getvalue()
+
+
+def _accepted_encoding():
+    for encoding, _ in PRECOMPRESSED:
+        if request.accept_encodings[encoding]:
+            return encoding
+    return None
+
+
+def _send_prerendered(path):
+    for encoding, suffix in PRECOMPRESSED:
+        if request.accept_encodings[encoding] and os.path.exists(path + suffix):
+            path += suffix
+            break
+    else:
+        encoding = None
+    with open(path, 'rb') as f:
+        response = Response(f.read(), mimetype='text/html')
+    if encoding:
+        response.content_encoding = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def _prerender_is_current():
+    # Only serve pre-rendered pages built from this exact build
+    if _BUILD_RECORD is None:
+        return False
+    if _BUILD_RECORD.get('build-id') != BUILD_ID:
+        app.logger.warning('Ignoring stale pre-rendered pages in %s (re-run scripts/09_prerender.py)', PRERENDER_DIR)
+        return False
+    return True
+
+
 def _make_chapter(name, chapter):
     tanakh = Tanakh()
     book = tanakh.get_book(name)
     title = '{} {}'.format(book.name, chapter)
     verses = list(book.iter_verses((chapter, None), (chapter, None)))
-    modals = _create_modals(verses)
-    return render_template('home.html', page='chapter', book=book, chapter=chapter, verses=verses, modals=modals)
+    hits = [SearchHit(verse) for verse in verses]
+    return render_template('home.html', page='chapter', book=book, chapter=chapter, hits=hits, **_create_modals(verses))
 
 
 def _make_chapter_select(name):
@@ -81,8 +295,7 @@ def _search(search_str, pag_page):
         name, start, end = passage
         book = tanakh.get_book(name)
         verses = list(book.iter_verses(start, end))
-        modals = _create_modals(verses)
-        kw.update({'verses': verses, 'modals': modals})
+        kw.update(_create_modals(verses), hits=[SearchHit(verse) for verse in verses])
         if start[0] == end[0] and start[1] is None and end[1] is None:
             return render_template('home.html', page='chapter', book=book, chapter=start[0], **kw)
         else:
@@ -90,7 +303,6 @@ def _search(search_str, pag_page):
             return render_template('home.html', page='search-result', title=title, **kw)
 
     # 2. English or tlit phrase
-    occurrences, verses = 0, []
     book_filter = options.get('book', options.get('books'))
     lang = {
         'he': 'he', 
@@ -102,12 +314,12 @@ def _search(search_str, pag_page):
     }.get(options.get('lang', options.get('lan')))
     start = (pag_page - 1) * SEARCH_LIMIT
     end = pag_page * SEARCH_LIMIT
-    num_occurrences, num_verses, verses = tanakh.search(search_str, start=start, end=end, book_filter=book_filter, lang=lang)
+    num_occurrences, num_verses, hits = tanakh.search(search_str, start=start, end=end, book_filter=book_filter, lang=lang)
     title = '{} <span style="font-size: 75%">occurrences of <span class="highlight">{}</span></span>'.format(
         num_occurrences, search_str)
-    modals = _create_modals(verses)
+    kw.update(_create_modals([hit.verse for hit in hits]))
     pagination = _paginate(pag_page, num_verses, kw['search_value'])
-    return render_template('home.html', page='search-result', title=title, verses=verses, modals=modals, 
+    return render_template('home.html', page='search-result', title=title, hits=hits,
         book_filter=tanakh.pretty_book_filter(book_filter), pagination=pagination, **kw)
 
 
@@ -143,15 +355,16 @@ def _pretty_passage(book, start, end):
 
 
 def _create_modals(verses):
-    lexicon = Lexicon()
-    modals, used = [], set()
+    # Big pages get a single modal that fetches word details from /api/word on click (see ?modals=)
+    tokens = {}
     for verse in verses:
         for token in verse.he_tokens:
-            if token.word not in used:
-                desc = lexicon.description(token.word)
-                modals.append((token, desc))
-                used.add(token.word)
-    return modals
+            tokens.setdefault(token.word, token)
+    mode = request.args.get('modals')
+    if mode == 'lazy' or (mode != 'eager' and len(tokens) >= LAZY_MODALS_MIN_WORDS):
+        return {'modals': [], 'lazy_modals': True}
+    lexicon = shared_lexicon()
+    return {'modals': [(token, lexicon.description(word)) for word, token in tokens.items()], 'lazy_modals': False}
 
 
 def _paginate(pag_page, num_verses, search_value):
@@ -159,12 +372,19 @@ def _paginate(pag_page, num_verses, search_value):
         num_pages = int(math.ceil(num_verses / SEARCH_LIMIT))
         pagination = []
         href_func = lambda pg: "/search?{}".format(urllib.parse.urlencode({'text': search_value, 'page': pg}))
-        for i in range(1, num_pages + 1):
+        # Always link the first and last pages, plus a window around the current one
+        pages = {1, num_pages} | set(range(max(pag_page - PAGINATION_WINDOW, 1), min(pag_page + PAGINATION_WINDOW, num_pages) + 1))
+        pages |= {i + 1 for i in pages if i + 2 in pages}  # <- No point in an ellipsis for one page
+        prev_i = 0
+        for i in sorted(pages):
+            if i > prev_i + 1:
+                pagination.append({'symbol': '&hellip;', 'class': 'disabled', 'href': '#'})
             pagination.append({
                 'symbol': i,
                 'class': 'active' if i == pag_page else '',
                 'href': href_func(i),
             })
+            prev_i = i
         previous = {
             'symbol': '&laquo;',
             'class': 'disabled' if pag_page == 1 else '',
@@ -178,6 +398,9 @@ def _paginate(pag_page, num_verses, search_value):
         return [previous] + pagination + [next_]
 
 
+_serve_prerendered = os.environ.get('B3_SERVE_PRERENDERED', '1') == '1' and _prerender_is_current()
+
+
 if __name__ == '__main__':
     # This is used when running locally only. When deploying to Google App
     # Engine, a webserver process such as Gunicorn will serve the app. This
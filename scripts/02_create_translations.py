@@ -1,45 +1,70 @@
+import abc
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import html
 import json
+import os
 import os.path
 import re
+import time
 
 import bs4
-# Setup guide: https://cloud.google.com/translate/docs/quickstart-client-libraries
-from google.cloud import translate
 
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
-from b3.book import Tanakh
+from b3.book import token_types
+from b3.throttle import RateLimiter
 
 
 LEXICON_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'resources', 'lexicon')
+SUB_WORDS = [(None, None), (None, -1), (1, None), (1, -1)]  # <- The word, and without a prefix and/or suffix letter
 
 
-def run():
+class Translator(abc.ABC):
+	"""Translates batches of Hebrew words into English."""
+	@abc.abstractmethod
+	def translate(self, words):
+		"""The translations of a list of words (in the same order)."""
+
+
+class GoogleTranslator(Translator):
+	"""Google Cloud Translation (this costs money!)."""
+	def __init__(self):
+		# Setup guide: https://cloud.google.com/translate/docs/quickstart-client-libraries
+		from google.cloud import translate
+		self._client = translate.Client()
+
+	def translate(self, words):
+		results = self._client.translate(words, source_language='he', target_language='en')
+		return [html.unescape(x['translatedText']) for x in results]
+
+
+class FakeTranslator(Translator):
+	"""Local stand-in backend, for trying out the pipeline without spending money."""
+	def __init__(self, latency=0):
+		self.latency = latency
+
+	def translate(self, words):
+		time.sleep(self.latency)
+		return ['<{}>'.format(word) for word in words]
+
+
+_BACKENDS = {'google': GoogleTranslator, 'fake': FakeTranslator}
+
+
+def run(backend='google', **kw):
 	"""Translate all words.
 
 	Note
 	----
-	This will cost money! And may need to run a few times to get over request-rate limits.
+	This will cost money! Progress is checkpointed though, so it can be re-run to get over request-rate limits.
 	"""
 	print('1. Load what we already have')
-	translations = {}
 	json_path = os.path.join(LEXICON_DIR, 'GoogleTranslations.json')
-	if os.path.exists(json_path):
-		with open(json_path, 'r') as f:
-			translations = json.load(f)
+	translations = _load(json_path)
 
 	print('2. Fetch all words (and sub-words) from Tanakh')
-	tanakh = Tanakh()
-	words = set()
-	for book in tanakh.books:
-		for _, verses in book.iter_verses_by_chapter():
-			for verse in verses:
-				for token in verse.he_tokens:
-					w = token.word_no_vowels
-					for i, j in [(None, None), (None, -1), (1, None), (1, -1)]:
-						if w[i:j] not in translations:
-							words.add(w[i:j])
+	words = candidate_words(token_types('word_no_vowels'), translations)
 
 	print('3. Fetch all words available in Strongs')
 	with open(os.path.join(LEXICON_DIR, 'LexicalIndex.xml'), 'r') as f:
@@ -51,22 +76,86 @@ def run():
 	words = sorted(words)
 
 	print("4. Translating {} words".format(len(words)))
-	client = translate.Client()
-	chunk = 100
+	translate_all(words, _BACKENDS[backend](), translations, json_path, **kw)
+
+
+def candidate_words(types, translations):
+	"""The untranslated words and sub-words of the (distinct) words."""
+	return {w[i:j] for w in types for i, j in SUB_WORDS} - translations.keys()
+
+
+def translate_all(words, translator, translations, json_path, batch_size=100, concurrency=4, rate=None, max_chars=None, checkpoint_every=10):
+	"""Translate words in concurrent batches, saving the translations every few batches (and when stopping).
+
+	If a batch fails, the batches already sent are finished and saved before the error is re-raised.
+	`rate` limits the number of requests per second and `max_chars` the total characters sent (the quota).
+	"""
+	batches = [words[i:i + batch_size] for i in range(0, len(words), batch_size)]
+	if max_chars is not None:
+		num_chars, quota_batches = 0, []
+		for batch in batches:
+			num_chars += sum(len(word) for word in batch)
+			if num_chars > max_chars:
+				print('Only translating {} of {} batches, to stay within {} chars'.format(len(quota_batches), len(batches), max_chars))
+				break
+			quota_batches.append(batch)
+		batches = quota_batches
+	rate_limiter = RateLimiter(rate)
+
+	def translate(batch):
+		rate_limiter.wait()
+		return batch, translator.translate(batch)
+
+	executor = ThreadPoolExecutor(max_workers=concurrency)
+	futures = []
 	try:
-		for i in range(0, len(words), chunk):
-			print('Batch {}'.format(i))
-			batch = words[i:i + chunk]
-			results = client.translate(batch, source_language='he', target_language='en')
-			for word, trans in zip(batch, [html.unescape(x['translatedText']) for x in results]):
-				translations[word] = trans if word != trans else None
-	except Exception as e:
-		print(e)
-	
-	print('5. Persist')
-	with open(json_path, 'w') as f:
+		futures.extend(executor.submit(translate, batch) for batch in batches)
+		for i, future in enumerate(as_completed(futures), start=1):
+			_add(translations, *future.result())
+			print('Batch {}/{}'.format(i, len(batches)))
+			if i % checkpoint_every == 0:
+				_save(translations, json_path)
+	finally:
+		# On an error (which is re-raised) or interrupt, drop the pending batches but keep every finished one
+		for future in futures:  # <- Not shutdown(cancel_futures=True), which needs python 3.9
+			future.cancel()
+		executor.shutdown(wait=True)  # <- Batches already sent have been paid for
+		for future in futures:
+			if not future.cancelled() and future.exception() is None:
+				_add(translations, *future.result())
+		print('5. Persist')
+		_save(translations, json_path)
+	return translations
+
+
+def _add(translations, batch, results):
+	for word, trans in zip(batch, results):
+		translations[word] = trans if word != trans else None
+
+
+def _load(json_path):
+	if os.path.exists(json_path):
+		with open(json_path, 'r') as f:
+			return json.load(f)
+	return {}
+
+
+def _save(translations, json_path):
+	# Write to a temp file first, so an interruption can't leave a half-written json
+	tmp_path = json_path + '.tmp'
+	with open(tmp_path, 'w') as f:
 		json.dump(translations, f)
+	os.replace(tmp_path, json_path)
 
 
 if __name__ == "__main__":
-	run()
+	parser = argparse.ArgumentParser(description='Translate all words (this will cost money with the google backend!)')
+	parser.add_argument('--backend', choices=sorted(_BACKENDS), default='google')
+	parser.add_argument('--batch-size', type=int, default=100)
+	parser.add_argument('--concurrency', type=int, default=4)
+	parser.add_argument('--rate', type=float, default=None, help='Max requests per second')
+	parser.add_argument('--max-chars', type=int, default=None, help='Max total chars to send (the quota)')
+	parser.add_argument('--checkpoint-every', type=int, default=10, help='Save after this many batches')
+	args = parser.parse_args()
+	run(args.backend, batch_size=args.batch_size, concurrency=args.concurrency, rate=args.rate,
+		max_chars=args.max_chars, checkpoint_every=args.checkpoint_every)
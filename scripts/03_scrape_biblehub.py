@@ -1,57 +1,155 @@
+import argparse
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 import json
+import os
 import os.path
 import re
+import threading
+import time
+
 import requests
+from requests.adapters import HTTPAdapter
 
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
 from b3.book import Tanakh
+from b3.throttle import RateLimiter
 
 
 LEXICON_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'resources', 'lexicon')
-BIBLEHUB_URL = 'https://biblehub.com/lexicon/{book}/{c}-{v}.htm'
+BIBLEHUB_URL = os.environ.get('B3_BIBLEHUB_URL', 'https://biblehub.com/lexicon/{book}/{c}-{v}.htm')
+BIBLEHUB_SLUGS = {'Song of Songs': 'songs'}  # <- Otherwise the lower-case name, with underscores for spaces
+_MAINTEXT_RE = re.compile('(<table[^>]+maintext[^>]+>.*?</table>)')
 
 
-def run():
-	"""Scrape raw lexical data from biblehub."""
-	if not os.path.exists(LEXICON_DIR):
-		os.mkdir(LEXICON_DIR)
-	for book in Tanakh().books:
-		path = os.path.join(LEXICON_DIR, 'BibleHubScrape.{}.json'.format(book.name.replace(' ', '_')))
+class Scraper(object):
+	"""Concurrent, resumable scraper of the biblehub lexicon pages (checkpointing every verse)."""
+	def __init__(self, base_url=BIBLEHUB_URL, concurrency=8, rate=5, retries=5, backoff=1, timeout=30, lexicon_dir=LEXICON_DIR):
+		self.base_url = base_url
+		self.concurrency = concurrency
+		self.retries = retries
+		self.backoff = backoff
+		self.timeout = timeout
+		self.lexicon_dir = lexicon_dir
+		self.session = requests.Session()
+		adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+		self.session.mount('http://', adapter)
+		self.session.mount('https://', adapter)
+		self._rate_limiter = RateLimiter(rate)
+
+	def scrape_book(self, book):
+		"""Scrape every verse of a book into BibleHubScrape.<name>.json (resuming any earlier attempt)."""
+		name = book.name.replace(' ', '_')
+		path = os.path.join(self.lexicon_dir, 'BibleHubScrape.{}.json'.format(name))
 		if os.path.exists(path):
-			with open(path, 'r') as f:
-				data = json.load(f)['data']
-				c_start = data[-1]['c']
-				v_start = data[-1]['v'] + 1
-		else:
-			data = []
-			c_start = 1
-			v_start = 1
-		for c in range(c_start, 1000):
-			for v in range(v_start, 1000):
-				url = BIBLEHUB_URL.format(book=book.bhub, c=c, v=v)
-				try:
-					success = True
-					res = requests.get(url)
-				except:
-					success = False
-					break
-				if res.status_code == 404:
-					break
-				content = res.content.decode('utf-8')
-				content = re.search('(<table[^>]+maintext[^>]+>.*?</table>)', content).group(0)
-				data.append({'c': c, 'v': v, 'html': content, 'url': url})
-				print('Loaded {b} {c}:{v}'.format(b=book.name, c=c, v=v))
-			if v == 1:
-				break
-			v_start = 1
+			return path
+		checkpoint_path = path.replace('.json', '.partial.jsonl')
+		scrape = _BookScrape(self, BIBLEHUB_SLUGS.get(book.name, name.lower()), checkpoint_path)
+		chapter_lens = Counter(verse.c for verse in book.iter_verses())
+		with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+			# 1. All the verses we know of
+			list(executor.map(lambda cv: scrape.verse(*cv), [(c, v) for c, n in sorted(chapter_lens.items()) for v in range(1, n + 1)]))
+			# 2. ...then any past the end of each chapter or the book, as biblehub uses the English versification
+			list(executor.map(scrape.verses_from, sorted(chapter_lens), [n + 1 for _, n in sorted(chapter_lens.items())]))
+		c = max(chapter_lens) + 1
+		while scrape.verses_from(c, 1):
+			c += 1
+		data = [{'c': c, 'v': v, 'html': html, 'url': self.url(scrape.slug, c, v)} for (c, v), html in sorted(scrape.done.items()) if html]
 		with open(path, 'w') as f:
 			json.dump({'data': data}, f)
-		if not success:
-			print('Think there was a connection error :(')
+		os.remove(checkpoint_path)
+		return path
+
+	def url(self, slug, c, v):
+		"""Url of the lexicon page for a verse."""
+		return self.base_url.format(book=slug, c=c, v=v)
+
+	def fetch(self, url):
+		"""The maintext table of a page, or None if it doesn't exist (retrying errors with backoff)."""
+		for attempt in range(self.retries + 1):
+			self._rate_limiter.wait()
+			try:
+				res = self.session.get(url, timeout=self.timeout)
+				if res.status_code == 404:
+					return None
+				if res.status_code != 429 and res.status_code < 500:
+					res.raise_for_status()
+					match = _MAINTEXT_RE.search(res.content.decode('utf-8'))
+					if match is None:
+						raise ScrapeError('No maintext table in {}'.format(url))
+					return match.group(0)
+				error = '{} {}'.format(res.status_code, res.reason)
+			except requests.HTTPError as e:
+				raise ScrapeError('Failed to fetch {} ({})'.format(url, e))  # <- Other 4xx errors won't go away on a retry
+			except (requests.ConnectionError, requests.Timeout) as e:
+				error = e
+			if attempt < self.retries:
+				time.sleep(self.backoff * 2 ** attempt)
+		raise ScrapeError('Giving up on {} after {} attempts ({})'.format(url, self.retries + 1, error))
+
+
+class _BookScrape(object):
+	def __init__(self, scraper, slug, checkpoint_path):
+		self.scraper = scraper
+		self.slug = slug
+		self.checkpoint_path = checkpoint_path
+		self._lock = threading.Lock()
+		self.done = {}  # <- (c, v) -> html (or None if there's no such verse)
+		if os.path.exists(checkpoint_path):
+			with open(checkpoint_path, 'r') as f:
+				lines = f.read().split('\n')[:-1]  # <- Drop a half-written last line (from being killed)...
+			for line in lines:
+				item = json.loads(line)
+				self.done[item['c'], item['v']] = item['html']
+			with open(checkpoint_path, 'w') as f:  # <- ...so we can carry on appending to it
+				f.write(''.join(line + '\n' for line in lines))
+
+	def verse(self, c, v):
+		if (c, v) not in self.done:
+			html = self.scraper.fetch(self.scraper.url(self.slug, c, v))
+			with self._lock:
+				self.done[c, v] = html
+				with open(self.checkpoint_path, 'a') as f:
+					f.write(json.dumps({'c': c, 'v': v, 'html': html}) + '\n')
+			print('Loaded {} {}:{}{}'.format(self.slug, c, v, '' if html else ' (missing)'))
+		return self.done[c, v]
+
+	def verses_from(self, c, v):
+		# Keep going until a verse is missing, returning whether there were any
+		start = v
+		while self.verse(c, v):
+			v += 1
+		return v > start
+
+
+def run(names=None, **kw):
+	"""Scrape raw lexical data from biblehub."""
+	if not os.path.exists(LEXICON_DIR):
+		os.mkdir(LEXICON_DIR)
+	scraper = Scraper(**kw)
+	tanakh = Tanakh()
+	books = [tanakh.get_book(name) for name in names] if names else tanakh.books
+	for book in books:
+		start = time.time()
+		try:
+			path = scraper.scrape_book(book)
+		except ScrapeError as e:
+			print('Think there was a connection error :( ({})'.format(e))
 			break
+		print('Scraped {} into {} in {:.1f}s'.format(book.name, path, time.time() - start))
+
+
+class ScrapeError(Exception):
+	pass
 
 
 if __name__ == "__main__":
-	run()
-	
+	parser = argparse.ArgumentParser(description=run.__doc__)
+	parser.add_argument('books', nargs='*', help='Books to scrape (default: all not yet scraped)')
+	parser.add_argument('--base-url', default=BIBLEHUB_URL, help='Url template, with {book}, {c} and {v}')
+	parser.add_argument('--concurrency', type=int, default=8)
+	parser.add_argument('--rate', type=float, default=5, help='Max requests per second')
+	parser.add_argument('--retries', type=int, default=5)
+	args = parser.parse_args()
+	run(args.books, base_url=args.base_url, concurrency=args.concurrency, rate=args.rate, retries=args.retries)
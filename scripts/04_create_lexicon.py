@@ -1,16 +1,21 @@
 from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
 import glob
 import json
 import os.path
 import re
+import time
+from xml.etree.ElementTree import iterparse
+from xml.sax.saxutils import escape, quoteattr
 
-import bs4
 import requests
 
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
 from b3.book import Tanakh
 from b3.hebrew import Hebrew
+from b3.lexicon import ref_book, write_compact
 
 
 # Need to put HebrewStrong.xml and LexicalIndex.xml from https://github.com/openscriptures/HebrewLexicon into this dir:
@@ -21,31 +26,56 @@ PREFIXES = ['and', 'as', 'at', 'for', 'from', 'in', 'like', 'on', 'the', 'to', '
 SUFFIXES = ['he', 'her', 'his', 'my', 'our', 'she', 'their', 'they', 'we', 'you', 'your']
 PRE_AND_SUF = ['as they', 'in her', 'in his', 'in my', 'in their', 'they will', 'to her', 'to his', 'to my', 'to our', 'to their', 'with her', 'with his']
 
+_NS = '{http://openscriptures.github.com/morphhb/namespace}'
+_XML_NS = '{http://www.w3.org/XML/1998/namespace}'
+_ROW_RE = re.compile('<tr>.*?</tr>')
+_WORD_RE = re.compile('<span="hebrew3">([^<]*)</span>')
+_SID_RE = re.compile(r'http://strongsnumbers.com/hebrew\/(\w+)\.htm')
+_HEBREW = Hebrew()
 
-def run():
-    """Create an easy-to-use json Hebrew lexicon."""
+
+def run(jobs=None):
+    """Create an easy-to-use json Hebrew lexicon (plus its compact version, see b3.lexicon.write_compact)."""
     tanakh = Tanakh()
-    heb = Hebrew()
+    heb = _HEBREW
+    start = time.time()
 
-    print('1. Loading translations')
-    translations = _load_translations()
+    with _stage('1. Loading translations'):
+        translations = _load_translations()
 
-    print('2. Loading strongs')
-    strongs = _load_strongs(heb)
-    word_to_sid = _load_word_to_strongs_id(heb)
+    with _stage('2. Loading strongs'):
+        strongs = _load_strongs(heb)
+    with _stage('3. Loading bible-hub scrapings'):
+        word_to_sid = _load_word_to_strongs_id(jobs)
     # TODO: Possibly using the strongs-id as the "root" might be better...
     root_to_sids = defaultdict(set)
     for id_, entry in strongs.items():
         root_to_sids[entry['w-clean']].add(id_)
     root_to_sids = {root: sorted(ids, key=lambda x: int(x.strip('H'))) for root, ids in root_to_sids.items()}
 
-    print('3. Creating lexicon')
+    with _stage('4. Creating lexicon'):
+        lexicon, lexicon_root = _create_lexicon(tanakh, heb, translations, strongs, word_to_sid, root_to_sids)
+
+    with _stage('5. Persist'):
+        with open(os.path.join(LEXICON_DIR, 'Strongs.json'), 'w') as f:
+            json.dump(strongs, f)
+        with open(os.path.join(LEXICON_DIR, 'Lexicon.json'), 'w') as f:
+            json.dump(lexicon, f)
+        with open(os.path.join(LEXICON_DIR, 'LexiconRoot.json'), 'w') as f:
+            json.dump(lexicon_root, f)
+        write_compact('Lexicon.json', lexicon, LEXICON_DIR)
+        write_compact('LexiconRoot.json', lexicon_root, LEXICON_DIR)
+    print('Done in {:.1f}s'.format(time.time() - start))
+
+
+def _create_lexicon(tanakh, heb, translations, strongs, word_to_sid, root_to_sids):
     lexicon = {}
     lexicon_root = {}
-    for book in tanakh.books:
+    for book_num, book in enumerate(tanakh.books):
+        code = ref_book(book_num)
         for verse in book.iter_verses():
             for i, token in enumerate(verse.he_tokens):
-                ref = book.ref, verse.c, verse.v, i
+                ref = code, verse.c, verse.v, i
                 w = heb.strip_cantillations(token.word)
                 if w not in lexicon:
                     trans = translations.get(_clean(w))
@@ -69,14 +99,15 @@ def run():
                             'refs': [],
                         }
                     lexicon_root[root]['refs'].append(ref)
+    return lexicon, lexicon_root
+
 
-    print('4. Persist')
-    with open(os.path.join(LEXICON_DIR, 'Strongs.json'), 'w') as f:
-        json.dump(strongs, f)
-    with open(os.path.join(LEXICON_DIR, 'Lexicon.json'), 'w') as f:
-        json.dump(lexicon, f)
-    with open(os.path.join(LEXICON_DIR, 'LexiconRoot.json'), 'w') as f:
-        json.dump(lexicon_root, f)
+@contextlib.contextmanager
+def _stage(name):
+    print(name)
+    start = time.time()
+    yield
+    print('   ...took {:.1f}s'.format(time.time() - start))
 
 
 def _load_translations():
@@ -85,46 +116,71 @@ def _load_translations():
 
 
 def _load_strongs(heb):
-    with open(os.path.join(LEXICON_DIR, 'HebrewStrong.xml'), 'r') as f:
-        strongs_xml = bs4.BeautifulSoup(f.read(), 'html.parser')
+    # Stream the entries, rather than parsing the whole file into a tree
     strongs = {}
-    for x in strongs_xml.find_all('entry'):
-        w = heb.strip_cantillations(_get(x, 'w'))
-        strongs[x['id']] = {
-            'id': x['id'],
-            'w': w,
-            'w-clean': _clean(w),
-            'pron': x.find('w')['pron'],
-            'desc': '{}; {}'.format(_get(x, 'meaning'), _get(x, 'usage')).replace('None; ', '').replace('; None', ''),
+    for _, x in iterparse(os.path.join(LEXICON_DIR, 'HebrewStrong.xml')):
+        if x.tag != _NS + 'entry':
+            continue
+        w = x.find(_NS + 'w')
+        word = heb.strip_cantillations(_inner_xml(w))
+        meaning, usage = _inner_xml(x.find(_NS + 'meaning')), _inner_xml(x.find(_NS + 'usage'))
+        strongs[x.get('id')] = {
+            'id': x.get('id'),
+            'w': word,
+            'w-clean': _clean(word),
+            'pron': w.get('pron'),
+            'desc': '{}; {}'.format(meaning, usage).replace('None; ', '').replace('; None', ''),
         }
+        x.clear()
     return strongs
 
 
-def _load_word_to_strongs_id(heb):
-    # Figure out a unique mapping from word -> strongs-id based on bible-hub scrapings
-    strongs_map = defaultdict(lambda: Counter())
-    for path in glob.glob(os.path.join(LEXICON_DIR, 'BibleHubScrape.*.json')):
-        with open(path, 'r') as f:
-            data = json.load(f)['data']
-        for item in data:
-            for row in re.findall('<tr>.*?</tr>', item['html'])[1:]:
-                w = heb.strip_cantillations(re.search('<span="hebrew3">([^<]*)</span>', row).group(1))
-                w = heb.strip_punctuation(w)
-                w = heb.sort_niqqud(w)
-                sid = re.search('http://strongsnumbers.com/hebrew\/(\w+)\.htm', row)
-                if w and sid:
-                    w2 = w.replace('\u05b9\u05d5', '\u05d5\u05b9')
-                    sid = 'H' + sid.group(1).strip('abcd')  # <- HebrewStrong.xml doesn't seem to support
-                    strongs_map[w][sid] += 1                #    these "sub-entries"
-                    if w != w2:
-                        strongs_map[w2][sid] += 1
+def _load_word_to_strongs_id(jobs=None):
+    # Figure out a unique mapping from word -> strongs-id based on bible-hub scrapings (the per-file
+    # counts are merged in file order, so ties are broken just as if they'd been counted serially)
+    paths = glob.glob(os.path.join(LEXICON_DIR, 'BibleHubScrape.*.json'))
+    strongs_map = defaultdict(Counter)
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for counts in executor.map(_count_strongs_ids, paths):
+            for w, sid_counts in counts.items():
+                strongs_map[w].update(sid_counts)
     strongs_map = {w: sorted(counts.items(), key=lambda x: x[1])[-1][0] for w, counts in strongs_map.items()}
     return strongs_map
 
 
-def _get(entry, child):
-    if entry.find(child):
-        return ''.join([str(x) for x in entry.find(child).contents])
+def _count_strongs_ids(path):
+    strongs_map = defaultdict(Counter)
+    with open(path, 'r') as f:
+        data = json.load(f)['data']
+    for item in data:
+        for row in _ROW_RE.findall(item['html'])[1:]:
+            w = _HEBREW.normalize_key(_WORD_RE.search(row).group(1))
+            sid = _SID_RE.search(row)
+            if w and sid:
+                w2 = w.replace('\u05b9\u05d5', '\u05d5\u05b9')
+                sid = 'H' + sid.group(1).strip('abcd')  # <- HebrewStrong.xml doesn't seem to support
+                strongs_map[w][sid] += 1                #    these "sub-entries"
+                if w != w2:
+                    strongs_map[w2][sid] += 1
+    return strongs_map
+
+
+def _inner_xml(elem):
+    # The contents of an element as an xml string (without namespaces), or None
+    if elem is None:
+        return None
+    parts = [escape(elem.text or '')]
+    for child in elem:
+        tag = _local_name(child.tag)
+        attrs = ''.join(' {}={}'.format(_local_name(k), quoteattr(v)) for k, v in child.attrib.items())
+        parts.append('<{}{}>{}</{}>{}'.format(tag, attrs, _inner_xml(child), tag, escape(child.tail or '')))
+    return ''.join(parts)
+
+
+def _local_name(tag):
+    if tag.startswith(_XML_NS):
+        return 'xml:' + tag[len(_XML_NS):]
+    return tag.rpartition('}')[2]
 
 
 def _clean(w):
@@ -1,8 +1,12 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import glob
+import hashlib
 import json
 import os
 import os.path
 import re
+import time
 import urllib.parse
 
 import sys
@@ -10,20 +14,69 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
 from b3.hebrew import Hebrew
 
 
-_SEFARIA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'resources', 'sefaria')
+_ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+_SEFARIA_DIR = os.path.join(_ROOT_DIR, 'resources', 'sefaria')
+_MANIFEST_PATH = os.path.join(_SEFARIA_DIR, 'parse-manifest.json')
+# A change to any of these (e.g. a transliteration rule) means every book needs re-parsing
+_RULE_PATHS = [os.path.join(_ROOT_DIR, 'b3', 'hebrew.py'), os.path.realpath(__file__)]
 _HEBREW = Hebrew()
 
 
-def run():
-	"""Create and store tokenised/transliterated hebrew."""
-	for lan, fix_func in [('he', _tokenise_he_verse), ('en', _fix_en_verse)]:
-		for path in glob.glob(os.path.join(_SEFARIA_DIR, '*.{}.json'.format(lan))):
-			print('Parsing {}'.format(path))
-			with open(path, 'r') as f:
-				blob = json.load(f)
-			blob['text'] = [[fix_func(verse) for verse in chapter] for chapter in blob['text']]
-			with open(path.replace('.{}.'.format(lan), '.{}-parsed.'.format(lan)), 'w') as f:
-				json.dump(blob, f)
+def run(jobs=None, force=False):
+	"""Create and store tokenised/transliterated hebrew (only re-parsing books whose inputs have changed)."""
+	start = time.time()
+	manifest = {} if force else _load_manifest()
+	rules_hash = _hash_files(_RULE_PATHS)
+	todo, new_manifest = [], {}
+	for lan in ['he', 'en']:
+		for path in sorted(glob.glob(os.path.join(_SEFARIA_DIR, '*.{}.json'.format(lan)))):
+			name = os.path.basename(path)
+			new_manifest[name] = _hash_files([path], rules_hash)
+			if manifest.get(name) != new_manifest[name] or not os.path.exists(_parsed_path(path, lan)):
+				todo.append((path, lan))
+	print('Parsing {} of {} files ({} unchanged)'.format(len(todo), len(new_manifest), len(new_manifest) - len(todo)))
+
+	with ProcessPoolExecutor(max_workers=jobs) as executor:
+		futures = [executor.submit(_parse, path, lan) for path, lan in todo]
+		for i, future in enumerate(as_completed(futures), start=1):
+			path, elapsed = future.result()
+			print('[{}/{}] Parsed {} in {:.1f}s'.format(i, len(todo), os.path.basename(path), elapsed))
+
+	# Only written once everything has been parsed, so a failed run is retried next time
+	with open(_MANIFEST_PATH, 'w') as f:
+		json.dump(new_manifest, f, indent=1, sort_keys=True)
+	print('Done in {:.1f}s'.format(time.time() - start))
+
+
+def _parse(path, lan):
+	start = time.time()
+	fix_func = {'he': _tokenise_he_verse, 'en': _fix_en_verse}[lan]
+	with open(path, 'r') as f:
+		blob = json.load(f)
+	blob['text'] = [[fix_func(verse) for verse in chapter] for chapter in blob['text']]
+	with open(_parsed_path(path, lan), 'w') as f:
+		json.dump(blob, f)
+	return path, time.time() - start
+
+
+def _parsed_path(path, lan):
+	return path.replace('.{}.'.format(lan), '.{}-parsed.'.format(lan))
+
+
+def _load_manifest():
+	try:
+		with open(_MANIFEST_PATH, 'r') as f:
+			return json.load(f)
+	except FileNotFoundError:
+		return {}
+
+
+def _hash_files(paths, salt=''):
+	digest = hashlib.sha256(salt.encode())
+	for path in paths:
+		with open(path, 'rb') as f:
+			digest.update(f.read())
+	return digest.hexdigest()
 
 
 def _fix_en_verse(verse):
@@ -31,16 +84,19 @@ def _fix_en_verse(verse):
 
 
 def _tokenise_he_verse(verse):
-	tokens = []
 	verse = verse.replace('\u200d', '')  # Random "zero-width joiners"!
 	verse = _HEBREW.strip_cantillations(verse)
-	for w, ws in _HEBREW.split_tokens(verse):
-		wn = _HEBREW.strip_niqqud(w)
-		tlit = _HEBREW.transliterate(w)
-		tlit_s = _HEBREW.transliterate(ws)
-		tokens.append((w, ws, wn, tlit, tlit_s))
-	return tokens
+	pairs = list(_HEBREW.split_tokens(verse))
+	tlits = _HEBREW.transliterate_many([w for w, _ in pairs] + [ws for _, ws in pairs])
+	return [
+		(w, ws, _HEBREW.strip_niqqud(w), tlit, tlit_s)
+		for (w, ws), tlit, tlit_s in zip(pairs, tlits[:len(pairs)], tlits[len(pairs):])
+	]
 
 
 if __name__ == '__main__':
-	run()
\ No newline at end of file
+	parser = argparse.ArgumentParser(description=run.__doc__)
+	parser.add_argument('--jobs', type=int, default=None, help='Number of worker processes (default: num cpus)')
+	parser.add_argument('--force', action='store_true', help='Re-parse everything')
+	args = parser.parse_args()
+	run(jobs=args.jobs, force=args.force)
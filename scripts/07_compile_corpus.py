@@ -0,0 +1,32 @@
+import os
+import os.path
+import time
+
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from b3.book import Tanakh, dump_indexes, use_corpus_store
+from b3.store import compile_corpus
+
+
+_RESOURCES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'resources')
+_SEFARIA_DIR = os.path.join(_RESOURCES_DIR, 'sefaria')
+_OUTPUT_FILE = os.path.join(_RESOURCES_DIR, 'compiled', 'tanakh.b3c')
+
+
+def run():
+	"""Compile the parsed sefaria json into a memory-mappable binary store (plus its search indexes)."""
+	if not os.path.exists(os.path.dirname(_OUTPUT_FILE)):
+		os.mkdir(os.path.dirname(_OUTPUT_FILE))
+	start = time.time()
+	compile_corpus(_SEFARIA_DIR, [book.name for book in Tanakh().books], _OUTPUT_FILE)
+	print('Compiled {} ({:.1f} MB) in {:.1f}s'.format(
+		_OUTPUT_FILE, os.path.getsize(_OUTPUT_FILE) / 1024 / 1024, time.time() - start))
+	start = time.time()
+	use_corpus_store(_OUTPUT_FILE)
+	for path in dump_indexes():
+		print('Dumped {} ({:.1f} MB)'.format(path, os.path.getsize(path) / 1024 / 1024))
+	print('...in {:.1f}s'.format(time.time() - start))
+
+
+if __name__ == '__main__':
+	run()
@@ -0,0 +1,24 @@
+import json
+import os.path
+import time
+
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from b3.lexicon import write_compact
+
+
+LEXICON_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'resources', 'lexicon')
+
+
+def run():
+	"""Write compact versions of Lexicon.json and LexiconRoot.json (see b3.lexicon.write_compact)."""
+	for resource in ['Lexicon.json', 'LexiconRoot.json']:
+		start = time.time()
+		with open(os.path.join(LEXICON_DIR, resource), 'r') as f:
+			entries = json.load(f)
+		write_compact(resource, entries, LEXICON_DIR)
+		print('Compacted {} ({} entries) in {:.1f}s'.format(resource, len(entries), time.time() - start))
+
+
+if __name__ == '__main__':
+	run()
@@ -0,0 +1,17 @@
+import os.path
+import time
+
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import main
+
+
+def run():
+	"""Pre-render every chapter and chapter-select page (see main.prerender)."""
+	start = time.time()
+	num_pages = main.prerender()
+	print('Pre-rendered {} pages into {} in {:.1f}s'.format(num_pages, main.PRERENDER_DIR, time.time() - start))
+
+
+if __name__ == '__main__':
+	run()
@@ -0,0 +1,207 @@
+import argparse
+import datetime
+import fnmatch
+import json
+import os.path
+import platform
+import statistics
+import time
+
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import main
+from b3 import book as b3_book
+from b3.book import Tanakh
+from b3.hebrew import Hebrew
+from b3.lexicon import shared_lexicon
+from b3.store import CorpusStore
+
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'benchmarks', 'baseline.json')
+THRESHOLD = 1.1  # <- Medians more than 10% slower/faster than the baseline are flagged
+_HEBREW = Hebrew()
+_CLIENT = main.app.test_client()
+
+
+def _clear_caches():
+	b3_book._RESULTS_CACHE.clear()
+	shared_lexicon()._descriptions.clear()
+	_HEBREW._tlits.clear()
+
+
+def _search(search_str, **kw):
+	Tanakh().search(search_str, start=0, end=main.SEARCH_LIMIT, **kw)
+
+
+def _get(url):
+	response = _CLIENT.get(url)
+	assert response.status_code == 200, '{} -> {}'.format(url, response.status_code)
+
+
+def _verses(name, c1, c2=None):
+	return list(Tanakh().get_book(name).iter_verses((c1, None), (c2 or c1, None)))
+
+
+def _init_content_store():
+	store = b3_book._STORE
+	b3_book._STORE = CorpusStore(b3_book._STORE_PATH)  # <- Freshly mapped, so nothing is decoded yet
+	try:
+		_read_all(Tanakh().get_book('psalms')._init_content())
+	finally:
+		b3_book._STORE = store
+
+
+def _init_content_json():
+	store = b3_book._STORE
+	b3_book._STORE = False  # <- As if resources/compiled/tanakh.b3c didn't exist
+	try:
+		_read_all(Tanakh().get_book('psalms')._init_content())
+	finally:
+		b3_book._STORE = store
+
+
+def _read_all(content):
+	for verse in content:
+		verse.english
+		verse.he_tokens
+
+
+def _iter_tokens(verses):
+	for verse in verses:
+		for token in verse.he_tokens:
+			yield token
+
+
+def _create_modals(verses):
+	with main.app.test_request_context('/book?modals=eager'):
+		main._create_modals(verses)
+
+
+def _describe(name, c1, c2):
+	lexicon = shared_lexicon()
+	for token in _iter_tokens(_verses(name, c1, c2)):
+		lexicon.description(token.word)
+
+
+def _transliterate(name, c1, c2):
+	for token in _iter_tokens(_verses(name, c1, c2)):
+		_HEBREW.transliterate(token.word)
+
+
+def _transliterate_reverse(name, c1, c2):
+	# Whole verses of Hebrew, transliterated with the words in reverse (right-to-left) order
+	for verse in _verses(name, c1, c2):
+		_HEBREW.transliterate(''.join(token.word + token.word_space for token in verse.he_tokens), reverse=True)
+
+
+# (name, fn, cold) where cold cases are run with the search, lexicon and transliteration caches cleared
+CASES = [
+	('search/literal-en', lambda: _search('firmament', lang='en'), True),
+	('search/literal-he', lambda: _search('elohim', lang='he'), True),
+	('search/phrase-en', lambda: _search('Yahweh thy God', lang='en'), True),
+	('search/phrase-he', lambda: _search('nephesh chayah', lang='he'), True),
+	('search/wildcard-en', lambda: _search('bless*', lang='en'), True),
+	('search/wildcard-he', lambda: _search('*nephesh', lang='he'), True),
+	('search/book-filter', lambda: _search('king', book_filter='gen-deu,psa'), True),
+	('search/both-langs', lambda: _search('adam'), True),
+	('book/init-content-store', _init_content_store, True),
+	('book/init-content-json', _init_content_json, True),
+	('book/iter-verses-psalm-119', lambda: list(_iter_tokens(_verses('psalms', 119))), False),
+	('book/iter-verses-psalms', lambda: list(_iter_tokens(_verses('psalms', 1, 150))), False),
+	('lexicon/create-modals-genesis-1', lambda: _create_modals(_verses('genesis', 1)), True),
+	('lexicon/create-modals-psalm-119', lambda: _create_modals(_verses('psalms', 119)), True),
+	('lexicon/description-isaiah-1-5', lambda: _describe('isaiah', 1, 5), True),
+	('hebrew/transliterate-genesis-1-11', lambda: _transliterate('genesis', 1, 11), True),
+	('hebrew/transliterate-reverse-genesis-1-11', lambda: _transliterate_reverse('genesis', 1, 11), True),
+	# Full page renders (never from the pre-rendered pages, and without compression or 304s)
+	('render/book-genesis-1', lambda: _get('/book?name=Genesis&chapter=1'), True),
+	('render/book-psalms-119', lambda: _get('/book?name=Psalms&chapter=119'), True),
+	('render/book-chapter-select', lambda: _get('/book?name=Psalms'), True),
+	('render/search-passage', lambda: _get('/search?text=Isaiah+53'), True),
+	('render/search-en', lambda: _get('/search?text=light'), True),
+	('render/search-he', lambda: _get('/search?text=nephesh+lang:he'), True),
+	('render/search-book-filter-page-2', lambda: _get('/search?text=yahweh+book:gen-deu&page=2'), True),
+]
+if not os.path.exists(b3_book._STORE_PATH):
+	CASES = [c for c in CASES if c[0] != 'book/init-content-store']  # <- No compiled corpus to map
+
+
+def run_cases(repeat=5, pattern='*'):
+	"""Time the matching cases, returning {name: {'min-ms', 'median-ms'}}."""
+	serve_prerendered, main._serve_prerendered = main._serve_prerendered, False
+	try:
+		results = {}
+		for name, fn, cold in CASES:
+			if not fnmatch.fnmatch(name, pattern):
+				continue
+			fn()  # <- Warm up: load the corpus, indexes and lexicon so only the case itself is timed
+			times = []
+			for _ in range(repeat):
+				if cold:
+					_clear_caches()
+				start = time.perf_counter()
+				fn()
+				times.append((time.perf_counter() - start) * 1000)
+			results[name] = {'min-ms': round(min(times), 3), 'median-ms': round(statistics.median(times), 3)}
+		return results
+	finally:
+		main._serve_prerendered = serve_prerendered
+
+
+def environment(repeat):
+	"""What the results were measured on (timings are only comparable on the same setup)."""
+	store = b3_book._corpus_store()
+	return {
+		'python': platform.python_version(),
+		'machine': platform.machine(),
+		'corpus': store.build_id if store else None,
+		'attached-indexes': bool(store) and all(os.path.exists(path) for path in b3_book._index_paths(store).values()),
+		'repeat': repeat,
+	}
+
+
+def compare(results, baseline, threshold=THRESHOLD):
+	"""Lines of a table comparing the median of each case with the baseline."""
+	lines = ['{:<44} {:>10} {:>10} {:>7}'.format('case', 'ms', 'baseline', 'ratio')]
+	for name, result in results.items():
+		base = baseline.get(name)
+		if base is None:
+			lines.append('{:<44} {:>10.2f} {:>10} {:>7}'.format(name, result['median-ms'], '-', '-'))
+			continue
+		ratio = result['median-ms'] / base['median-ms'] if base['median-ms'] else float('inf')
+		flag = 'slower' if ratio > threshold else 'faster' if ratio < 1 / threshold else ''
+		lines.append('{:<44} {:>10.2f} {:>10.2f} {:>6.2f}x {}'.format(name, result['median-ms'], base['median-ms'], ratio, flag).rstrip())
+	return lines
+
+
+def run(repeat=5, pattern='*', baseline_path=BASELINE_PATH, save=False):
+	"""Benchmark search, book loading, the lexicon, transliteration and page renders against a stored baseline."""
+	results = run_cases(repeat, pattern)
+	env = environment(repeat)
+	baseline = {'environment': {}, 'cases': {}}
+	if os.path.exists(baseline_path):
+		with open(baseline_path, 'r') as f:
+			baseline = json.load(f)
+	for line in compare(results, baseline['cases']):
+		print(line)
+	differences = sorted(k for k in env if k != 'repeat' and baseline['environment'].get(k) != env[k])
+	if baseline['cases'] and differences:
+		print('Note: the baseline was measured with a different {}'.format(', '.join(differences)))
+	if save:
+		# Only replace the cases that were run, so a filtered run updates part of the baseline
+		cases = dict(baseline['cases'], **results)
+		os.makedirs(os.path.dirname(baseline_path), exist_ok=True)
+		with open(baseline_path, 'w') as f:
+			json.dump({'environment': env, 'date': datetime.date.today().isoformat(), 'cases': cases}, f, indent=2, sort_keys=True)
+			f.write('\n')
+		print('Saved {} cases to {}'.format(len(results), baseline_path))
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description=run.__doc__)
+	parser.add_argument('-k', '--pattern', default='*', help='Only run the cases matching this glob, e.g. "search/*"')
+	parser.add_argument('--repeat', type=int, default=5, help='Timed runs per case (the median is compared)')
+	parser.add_argument('--baseline', default=BASELINE_PATH, help='Baseline json to compare with')
+	parser.add_argument('--save', action='store_true', help='Save the results as the new baseline')
+	args = parser.parse_args()
+	run(repeat=args.repeat, pattern=args.pattern, baseline_path=args.baseline, save=args.save)